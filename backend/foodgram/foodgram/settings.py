@@ -107,6 +107,42 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static_backend')
 MEDIA_URL = '/media_backend/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media_backend')
 
+INGREDIENT_SEARCH_LIMIT = 20
+
+CATALOG_CACHE = os.getenv('CATALOG_CACHE')
+CATALOG_TTL = 300
+CATALOG_VERSION_INTERVAL = 1
+
+TRENDING_HALF_LIFE = 72 * 60 * 60
+TRENDING_WEIGHTS = {
+    'favorite': 1.0,
+    'shopping_cart': 2.0,
+}
+
+FEED_CELEBRITY_FOLLOWERS = 1000
+FEED_BACKFILL_LIMIT = 100
+
+RECIPE_IMAGE_MAX_SIDE = 8000
+RECIPE_IMAGE_MAX_SIZE = 10 * 1024 * 1024
+RECIPE_UPLOAD_MAX_SIZE = RECIPE_IMAGE_MAX_SIZE * 4 // 3 + 1024 * 1024
+RECIPE_IMAGE_VARIANTS = {
+    'thumb': 160,
+    'card': 480,
+    'full': 1280,
+}
+RECIPE_IMAGE_RELEASE_GRACE = 10 * 60
+
+RECIPE_BATCH_MAX_SIZE = 100
+RECIPE_CACHE_MAX_SIZE = 32 * 1024 * 1024
+
+BACKGROUND_TASK_WORKERS = 2
+BACKGROUND_TASKS_EAGER = False
+
+SHOPPING_LIST_FONT = os.getenv(
+    'SHOPPING_LIST_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
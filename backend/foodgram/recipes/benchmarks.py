@@ -0,0 +1,296 @@
+import math
+import time
+from datetime import timedelta
+from statistics import median
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from users.models import CustomUser, Subscribe
+
+from .cache import recipe_cache
+from .models import (CountOfIngredient, Ingredient, Recipe, RecipesFavorite,
+                     TimelineEntry)
+from .utils import update_trending_scores
+
+BENCHMARKS = {}
+BENCHMARK_PREFIX = 'benchmark'
+BENCHMARK_IMAGE = 'recipes/benchmark.png'
+BATCH_SIZE = 5000
+TRENDING_DAYS = 30
+COOKABLE_INGREDIENTS = 500
+FEED_PAGE_SIZE = 50
+
+
+def benchmark(name, size):
+    """Регистрирует замер для команды benchmark.
+
+    Функция получает размер данных и число повторов и возвращает
+    список результатов measure().
+    """
+    def decorator(func):
+        BENCHMARKS[name] = (func, size)
+        return func
+    return decorator
+
+
+def measure(label, func, repeat):
+    timings = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+    return label, median(timings), min(timings), len(context.captured_queries)
+
+
+def request(client, url, method='get', **kwargs):
+    response = getattr(client, method)(url, **kwargs)
+    if response.status_code >= 400:
+        raise AssertionError(f'{url}: {response.status_code}')
+    if response.streaming:
+        b''.join(response.streaming_content)
+    return response
+
+
+def get_client(user):
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+def create_users(count, role='user'):
+    CustomUser.objects.bulk_create(
+        CustomUser(
+            username=f'{BENCHMARK_PREFIX}-{role}-{i}',
+            email=f'{BENCHMARK_PREFIX}-{role}-{i}@example.com',
+            first_name=role,
+            last_name=str(i),
+            password=make_password(None),
+        )
+        for i in range(count)
+    )
+    return list(CustomUser.objects.filter(
+        username__startswith=f'{BENCHMARK_PREFIX}-{role}-'
+    ).order_by('pk'))
+
+
+def create_ingredients(count):
+    Ingredient.objects.bulk_create(
+        Ingredient(
+            name=f'{BENCHMARK_PREFIX} ингредиент {i}',
+            measurement_unit='г',
+            search_name=f'{BENCHMARK_PREFIX} ингредиент {i}',
+        )
+        for i in range(count)
+    )
+    return list(Ingredient.objects.filter(
+        name__startswith=f'{BENCHMARK_PREFIX} '
+    ).values_list('pk', flat=True).order_by('pk'))
+
+
+def create_recipes(authors, count, ingredient_ids=(), per_recipe=0):
+    """Создаёт рецепты в обход сигналов и возвращает их идентификаторы."""
+    Recipe.objects.bulk_create(
+        (
+            Recipe(
+                author=authors[i % len(authors)],
+                name=f'{BENCHMARK_PREFIX} {i}',
+                text=f'{BENCHMARK_PREFIX} {i}',
+                cooking_time=i % 120 + 1,
+                image=BENCHMARK_IMAGE,
+            )
+            for i in range(count)
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    recipe_ids = list(Recipe.objects.filter(
+        name__startswith=f'{BENCHMARK_PREFIX} '
+    ).values_list('pk', flat=True).order_by('pk'))
+    if per_recipe:
+        CountOfIngredient.objects.bulk_create(
+            (
+                CountOfIngredient(
+                    recipe_id=recipe_id,
+                    ingredients_id=ingredient_ids[
+                        (i * 7 + j) % len(ingredient_ids)
+                    ],
+                    amount=j + 1,
+                )
+                for i, recipe_id in enumerate(recipe_ids)
+                for j in range(per_recipe)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+    return recipe_ids
+
+
+@benchmark('shopping_list', size=200)
+def shopping_list(size, repeat):
+    user, = create_users(1)
+    ingredient_ids = create_ingredients(500)
+    recipe_ids = create_recipes([user], size, ingredient_ids, 10)
+    client = get_client(user)
+    for start in range(0, len(recipe_ids), 100):
+        request(client, '/api/recipes/shopping_cart/', 'post',
+                data={'recipes': recipe_ids[start:start + 100]},
+                format='json')
+    return [
+        measure(
+            f'скачивание списка покупок ({file_format}), рецептов: {size}',
+            lambda: request(
+                client,
+                '/api/recipes/download_shopping_cart/',
+                HTTP_ACCEPT=accept,
+            ),
+            repeat,
+        )
+        for file_format, accept in (
+            ('txt', 'text/plain'), ('pdf', 'application/pdf')
+        )
+    ]
+
+
+INGREDIENT_SYLLABLES = (
+    'ка', 'ро', 'со', 'ль', 'ма', 'ли', 'на', 'ту', 'ре', 'пе', 'ви', 'ша',
+)
+
+
+def get_ingredient_name(number):
+    syllables = []
+    for _ in range(3):
+        number, index = divmod(number, len(INGREDIENT_SYLLABLES))
+        syllables.append(INGREDIENT_SYLLABLES[index])
+    return f'{"".join(syllables).capitalize()} {number}'
+
+
+@benchmark('ingredient_autocomplete', size=2000)
+def ingredient_autocomplete(size, repeat):
+    Ingredient.objects.bulk_create(
+        (
+            Ingredient(
+                name=get_ingredient_name(i),
+                measurement_unit='г',
+                search_name=get_ingredient_name(i).lower(),
+            )
+            for i in range(size)
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    client = APIClient()
+    return [
+        measure(
+            f'автодополнение «{query}», ингредиентов: {size}',
+            lambda: request(client, '/api/ingredients/', data={'name': query}),
+            repeat,
+        )
+        for query in ('к', 'ка', 'каро', 'оль')
+    ]
+
+
+@benchmark('cookable', size=100_000)
+def cookable(size, repeat):
+    authors = create_users(10)
+    ingredient_ids = create_ingredients(COOKABLE_INGREDIENTS)
+    create_recipes(authors, size, ingredient_ids, 8)
+    client = APIClient()
+    return [
+        measure(
+            f'подбор рецептов по {count} ингредиентам{suffix}, '
+            f'рецептов: {size}',
+            lambda: request(client, '/api/recipes/cookable/', data={
+                'ingredients': ingredient_ids[:count], **params,
+            }),
+            repeat,
+        )
+        for count in (5, 50)
+        for suffix, params in (
+            ('', {}),
+            (' без недостающих', {'max_missing': 0}),
+        )
+    ]
+
+
+@benchmark('recipe_cache', size=1000)
+def recipe_cache_feed(size, repeat):
+    """Лента подписок с холодным и прогретым кешем рецептов."""
+    user, = create_users(1, 'reader')
+    authors = create_users(10)
+    ingredient_ids = create_ingredients(100)
+    create_recipes(authors, size, ingredient_ids, 8)
+    Subscribe.objects.bulk_create(
+        Subscribe(user=user, author=author) for author in authors
+    )
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(
+                user=user,
+                recipe_id=recipe_id,
+                author_id=author_id,
+                pub_date=pub_date,
+            )
+            for recipe_id, author_id, pub_date in Recipe.objects.filter(
+                author__in=authors
+            ).values_list('id', 'author_id', 'pub_date')
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    client = get_client(user)
+    url = f'/api/recipes/feed/?limit={FEED_PAGE_SIZE}'
+
+    def cold():
+        recipe_cache.clear()
+        request(client, url)
+
+    request(client, url)
+    return [
+        measure(f'лента, {FEED_PAGE_SIZE} рецептов, {label}', func, repeat)
+        for label, func in (
+            ('без кеша', cold),
+            ('с прогретым кешем', lambda: request(client, url)),
+        )
+    ]
+
+
+@benchmark('trending', size=1_000_000)
+def trending(size, repeat):
+    """Каждый пользователь добавляет в избранное каждый рецепт."""
+    count = max(math.isqrt(size), 2)
+    users = create_users(count)
+    recipe_ids = create_recipes(users[:10], count)
+    RecipesFavorite.objects.bulk_create(
+        (
+            RecipesFavorite(user=user, recipe_id=recipe_id)
+            for user in users
+            for recipe_id in recipe_ids
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    now = timezone.now()
+    for day in range(TRENDING_DAYS):
+        RecipesFavorite.objects.filter(
+            recipe_id__in=recipe_ids[day::TRENDING_DAYS]
+        ).update(created=now - timedelta(days=day))
+    client = APIClient()
+    favorites = count * count
+    return [
+        measure(
+            f'полный пересчёт рейтинга, избранного: {favorites}',
+            lambda: update_trending_scores(full=True),
+            repeat,
+        ),
+        measure(
+            f'пересчёт рейтинга без новых событий, рецептов: {count}',
+            update_trending_scores,
+            repeat,
+        ),
+        measure(
+            f'страница ?ordering=trending, рецептов: {count}',
+            lambda: request(client, '/api/recipes/',
+                            data={'ordering': 'trending'}),
+            repeat,
+        ),
+    ]
@@ -0,0 +1,71 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class RecipeCache:
+    """Сериализованные рецепты в памяти процесса.
+
+    Для каждого рецепта хранится одна запись: версия и JSON без
+    пользовательских полей в виде байтов. Запись с другой версией
+    считается промахом. Когда суммарный размер превышает
+    RECIPE_CACHE_MAX_SIZE, вытесняются давно не читавшиеся записи.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, recipe_id, version):
+        with self._lock:
+            entry = self._entries.get(recipe_id)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(recipe_id)
+            self.hits += 1
+            return entry[1]
+
+    def has(self, recipe_id, version):
+        entry = self._entries.get(recipe_id)
+        return entry is not None and entry[0] == version
+
+    def set(self, recipe_id, version, data):
+        max_size = settings.RECIPE_CACHE_MAX_SIZE
+        if len(data) > max_size:
+            return
+        with self._lock:
+            self._pop(recipe_id)
+            self._entries[recipe_id] = (version, data)
+            self._size += len(data)
+            while self._size > max_size:
+                self._pop(next(iter(self._entries)))
+
+    def _pop(self, recipe_id):
+        entry = self._entries.pop(recipe_id, None)
+        if entry is not None:
+            self._size -= len(entry[1])
+
+    def invalidate(self, recipe_id):
+        with self._lock:
+            self._pop(recipe_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'recipes': len(self._entries),
+            'size': self._size,
+        }
+
+
+recipe_cache = RecipeCache()
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import Ingredient, Tag
+
+VERSION_KEY = 'recipes:catalog:version'
+
+
+def get_checksum(data):
+    return hashlib.sha1(
+        json.dumps(data, sort_keys=True, ensure_ascii=False).encode()
+    ).hexdigest()
+
+
+class Catalog:
+    """Справочники тегов и ингредиентов в памяти процесса.
+
+    Данные перечитываются из базы при смене версии каталога или по
+    истечении CATALOG_TTL. Если задан CATALOG_CACHE, версия хранится
+    в общем кеше и читается из него не чаще раза в
+    CATALOG_VERSION_INTERVAL секунд, так что инвалидация видна
+    другим процессам с этой задержкой.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local_version = 1
+        self._loaded_version = None
+        self._loaded_at = 0
+        self._shared_version = None
+        self._version_checked_at = 0
+        self._tags = []
+        self._tags_by_id = {}
+        self._tags_by_slug = {}
+        self._ingredients = []
+        self._ingredients_by_id = {}
+        self._tags_checksum = ''
+        self._ingredients_checksum = ''
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def shared_cache(self):
+        alias = settings.CATALOG_CACHE
+        return caches[alias] if alias else None
+
+    @property
+    def version(self):
+        cache = self.shared_cache
+        if cache is None:
+            return self._local_version
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            cache.add(VERSION_KEY, 1, timeout=None)
+            version = cache.get(VERSION_KEY, 1)
+        return version
+
+    def get_version(self):
+        if self.shared_cache is None:
+            return self._local_version
+        now = time.monotonic()
+        if (self._shared_version is None or now - self._version_checked_at
+                >= settings.CATALOG_VERSION_INTERVAL):
+            self._shared_version = self.version
+            self._version_checked_at = now
+        return self._shared_version
+
+    def invalidate(self):
+        """Сбрасывает каталог после коммита текущей транзакции.
+
+        Если сменить версию до коммита, параллельный запрос может
+        перечитать ещё старые строки и закешировать их под новой
+        версией.
+        """
+        transaction.on_commit(self._invalidate)
+
+    def _invalidate(self):
+        with self._lock:
+            self._local_version += 1
+            self._loaded_version = None
+        cache = self.shared_cache
+        if cache is not None:
+            try:
+                version = cache.incr(VERSION_KEY)
+            except ValueError:
+                version = 2
+                cache.set(VERSION_KEY, version, timeout=None)
+            self._shared_version = version
+            self._version_checked_at = time.monotonic()
+
+    def _load(self, version):
+        tags = list(Tag.objects.values('id', 'name', 'color', 'slug'))
+        ingredients = list(
+            Ingredient.objects.values('id', 'name', 'measurement_unit')
+        )
+        self._tags = tags
+        self._tags_by_id = {tag['id']: tag for tag in tags}
+        self._tags_by_slug = {tag['slug']: tag for tag in tags}
+        self._ingredients = ingredients
+        self._ingredients_by_id = {
+            ingredient['id']: ingredient for ingredient in ingredients
+        }
+        self._tags_checksum = get_checksum(tags)
+        self._ingredients_checksum = get_checksum(ingredients)
+        self._loaded_version = version
+        self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        version = self.get_version()
+        expired = time.monotonic() - self._loaded_at > settings.CATALOG_TTL
+        if self._loaded_version == version and not expired:
+            self.hits += 1
+            return
+        with self._lock:
+            self.misses += 1
+            self._load(version)
+
+    def get_tags(self):
+        self._ensure_loaded()
+        return self._tags
+
+    def get_tag(self, tag_id):
+        self._ensure_loaded()
+        return self._tags_by_id.get(tag_id)
+
+    def get_tags_by_slug(self, slugs):
+        self._ensure_loaded()
+        return [
+            self._tags_by_slug[slug]
+            for slug in slugs if slug in self._tags_by_slug
+        ]
+
+    def get_tags_checksum(self):
+        self._ensure_loaded()
+        return self._tags_checksum
+
+    def get_ingredients_checksum(self):
+        self._ensure_loaded()
+        return self._ingredients_checksum
+
+    def get_tag_choices(self):
+        return [(tag['slug'], tag['name']) for tag in self.get_tags()]
+
+    def get_ingredients(self):
+        self._ensure_loaded()
+        return self._ingredients
+
+    def get_ingredient(self, ingredient_id):
+        self._ensure_loaded()
+        return self._ingredients_by_id.get(ingredient_id)
+
+    def stats(self):
+        return {
+            'version': self.version,
+            'hits': self.hits,
+            'misses': self.misses,
+            'tags': len(self._tags),
+            'ingredients': len(self._ingredients),
+        }
+
+
+catalog = Catalog()
@@ -0,0 +1,46 @@
+import hashlib
+from functools import wraps
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+
+def get_etag(request, state):
+    key = repr((
+        request.get_full_path(),
+        request.accepted_renderer.format,
+        request.user.pk,
+        state,
+    ))
+    return quote_etag(hashlib.sha1(key.encode()).hexdigest())
+
+
+def conditional_get(handler):
+    """ETag и Last-Modified для list и retrieve.
+
+    Представление возвращает из get_conditional_state() значения,
+    от которых зависит тело ответа, и дату последнего изменения
+    (или None); состояние None отключает проверку. Ответ 304
+    отдаётся по If-None-Match до сериализации. Last-Modified только
+    информирует клиента: он не учитывает удаления и флаги
+    пользователя, поэтому If-Modified-Since не проверяется.
+    """
+    @wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        state, last_modified = self.get_conditional_state(
+            request, *args, **kwargs
+        )
+        if state is None:
+            return handler(self, request, *args, **kwargs)
+        etag = get_etag(request, state)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = handler(self, request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+        patch_vary_headers(response, ('Accept', 'Authorization'))
+        return response
+    return wrapper
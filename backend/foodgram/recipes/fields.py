@@ -0,0 +1,94 @@
+import base64
+import binascii
+import uuid
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from PIL import Image, ImageOps
+from rest_framework import serializers
+
+BASE64_HEADER = ';base64,'
+BASE64_CHUNK_SIZE = 64 * 1024
+INVALID_IMAGE_ERROR = 'Загрузите корректную картинку'
+IMAGE_TOO_LARGE_ERROR = 'Картинка не должна быть больше {max_size} МБ'
+METADATA_KEYS = ('exif', 'xmp', 'XML:com.adobe.xmp')
+STRIP_OPTIONS = {
+    'JPEG': {'quality': 95},
+    'WEBP': {'quality': 95},
+}
+
+
+class Base64ImageField(serializers.ImageField):
+    """Картинка строкой base64 или файлом из multipart-запроса.
+
+    Строка base64 раскодируется частями во временный файл на диске,
+    поэтому раскодированная картинка целиком в памяти не держится.
+    Файлу даётся случайное имя с расширением по формату картинки.
+    EXIF и XMP, в том числе координаты съёмки, из картинки удаляются.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            data = self.decode(data)
+        self.check_size(data.size)
+        try:
+            with Image.open(data) as image:
+                extension = image.format.lower()
+                if self.has_metadata(image):
+                    data = self.strip_metadata(image, data)
+        except (OSError, ValueError):
+            raise serializers.ValidationError(INVALID_IMAGE_ERROR)
+        data.seek(0)
+        data.name = f'{uuid.uuid4()}.{extension}'
+        return super().to_internal_value(data)
+
+    def has_metadata(self, image):
+        if getattr(image, 'is_animated', False):
+            return False
+        return bool(image.getexif()) or any(
+            key in image.info for key in METADATA_KEYS
+        )
+
+    def strip_metadata(self, image, data):
+        """Пересохраняет картинку без метаданных.
+
+        Поворот из EXIF применяется к пикселям, цветовой профиль
+        сохраняется.
+        """
+        image_format = image.format
+        options = dict(STRIP_OPTIONS.get(image_format, {}))
+        if image.info.get('icc_profile'):
+            options['icc_profile'] = image.info['icc_profile']
+        file = TemporaryUploadedFile(
+            'image', Image.MIME.get(image_format), 0, None
+        )
+        ImageOps.exif_transpose(image).save(file, image_format, **options)
+        file.size = file.tell()
+        data.close()
+        return file
+
+    def check_size(self, size):
+        max_size = settings.RECIPE_IMAGE_MAX_SIZE
+        if size > max_size:
+            raise serializers.ValidationError(IMAGE_TOO_LARGE_ERROR.format(
+                max_size=max_size // (1024 * 1024)
+            ))
+
+    def decode(self, data):
+        start = data.find(BASE64_HEADER)
+        header = data[:start].replace('data:', '') if start != -1 else ''
+        offset = start + len(BASE64_HEADER) if start != -1 else 0
+        self.check_size((len(data) - offset) // 4 * 3)
+        file = TemporaryUploadedFile('image', header or None, 0, None)
+        try:
+            for chunk_start in range(offset, len(data), BASE64_CHUNK_SIZE):
+                file.write(base64.b64decode(
+                    data[chunk_start:chunk_start + BASE64_CHUNK_SIZE],
+                    validate=True,
+                ))
+        except (binascii.Error, ValueError):
+            file.close()
+            raise serializers.ValidationError(INVALID_IMAGE_ERROR)
+        file.size = file.tell()
+        file.seek(0)
+        return file
@@ -1,11 +1,188 @@
 import django_filters as filters
+from django.conf import settings
+from django.db.models import (Case, Count, Exists, IntegerField, OuterRef,
+                              Value, When)
+from rest_framework.filters import BaseFilterBackend
 
-from recipes.models import Recipe
+from recipes.catalog import catalog
+from recipes.models import (Recipe, RecipesFavorite, Shoplist,
+                            normalize_search)
+from recipes.search import is_postgresql, search_recipes
+from users.pagination import KeysetPagination
 
+TAGS_MODES = (('any', 'any'), ('all', 'all'))
+BOOLEAN_CHOICES = (
+    ('1', '1'), ('0', '0'), ('true', 'true'), ('false', 'false')
+)
+MAX_CHARACTER = chr(0x10FFFF)
 
-class TagsFilter(filters.FilterSet):
-    tags = filters.AllValuesMultipleFilter(field_name='tags__slug')
+
+def to_bool(value):
+    return value in ('1', 'true')
+
+
+def get_tag_choices():
+    return catalog.get_tag_choices()
+
+
+class RecipeFilter(filters.FilterSet):
+    """Фильтры списка рецептов.
+
+    Слаги тегов переводятся в id по каталогу тегов. При tags_mode=any
+    рецепт подходит, если у него есть хотя бы один из тегов, при
+    tags_mode=all нужны все теги сразу. Теги, избранное и список
+    покупок проверяются подзапросами EXISTS, без JOIN и DISTINCT.
+    """
+    tags = filters.MultipleChoiceFilter(
+        choices=get_tag_choices,
+        method='filter_tags',
+    )
+    tags_mode = filters.ChoiceFilter(
+        choices=TAGS_MODES,
+        method='filter_tags_mode',
+    )
+    author = filters.NumberFilter(field_name='author_id')
+    cooking_time__lte = filters.NumberFilter(
+        field_name='cooking_time', lookup_expr='lte'
+    )
+    cooking_time__gte = filters.NumberFilter(
+        field_name='cooking_time', lookup_expr='gte'
+    )
+    is_favorited = filters.TypedChoiceFilter(
+        choices=BOOLEAN_CHOICES,
+        coerce=to_bool,
+        method='filter_is_favorited',
+    )
+    is_in_shopping_cart = filters.TypedChoiceFilter(
+        choices=BOOLEAN_CHOICES,
+        coerce=to_bool,
+        method='filter_is_in_shopping_cart',
+    )
 
     class Meta:
         model = Recipe
-        fields = ('tags',)
+        fields = ('tags', 'tags_mode', 'author', 'cooking_time__lte',
+                  'cooking_time__gte', 'is_favorited', 'is_in_shopping_cart')
+
+    def filter_tags(self, queryset, name, value):
+        tag_ids = {tag['id'] for tag in catalog.get_tags_by_slug(set(value))}
+        recipe_tags = Recipe.tags.through.objects.filter(tag_id__in=tag_ids)
+        if self.form.cleaned_data.get('tags_mode') == 'all':
+            return queryset.filter(pk__in=recipe_tags.values(
+                'recipe_id'
+            ).annotate(count=Count('tag_id')).filter(
+                count=len(tag_ids)
+            ).values('recipe_id'))
+        return queryset.filter(
+            Exists(recipe_tags.filter(recipe_id=OuterRef('pk')))
+        )
+
+    def filter_tags_mode(self, queryset, name, value):
+        return queryset
+
+    def filter_user_recipes(self, queryset, model, value):
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset.none() if value else queryset
+        condition = Exists(
+            model.objects.filter(user=user, recipe=OuterRef('pk'))
+        )
+        return queryset.filter(condition if value else ~condition)
+
+    def filter_is_favorited(self, queryset, name, value):
+        return self.filter_user_recipes(queryset, RecipesFavorite, value)
+
+    def filter_is_in_shopping_cart(self, queryset, name, value):
+        return self.filter_user_recipes(queryset, Shoplist, value)
+
+
+class IngredientSearchFilter(BaseFilterBackend):
+    search_param = settings.REST_FRAMEWORK['SEARCH_PARAM']
+    limit_param = 'limit'
+    min_substring_length = 3
+
+    def get_limit(self, request):
+        max_limit = settings.INGREDIENT_SEARCH_LIMIT
+        try:
+            limit = int(request.query_params[self.limit_param])
+        except (KeyError, ValueError):
+            return max_limit
+        return min(max(limit, 1), max_limit)
+
+    def filter_prefix(self, queryset, query):
+        """Префиксный поиск по индексу search_name.
+
+        На PostgreSQL LIKE 'x%' использует индекс varchar_pattern_ops.
+        Другие базы, например SQLite, для LIKE индекс не используют,
+        поэтому там префикс задаётся диапазоном значений.
+        """
+        if is_postgresql():
+            return queryset.filter(search_name__startswith=query)
+        return queryset.filter(
+            search_name__gte=query, search_name__lt=query + MAX_CHARACTER
+        )
+
+    def filter_queryset(self, request, queryset, view):
+        query = normalize_search(
+            request.query_params.get(self.search_param, '')
+        )
+        if not query or view.action != 'list':
+            return queryset
+        if len(query) < self.min_substring_length:
+            queryset = self.filter_prefix(
+                queryset, query
+            ).order_by('search_name')
+        else:
+            queryset = queryset.filter(
+                search_name__contains=query
+            ).annotate(
+                rank=Case(
+                    When(search_name__startswith=query, then=Value(0)),
+                    default=Value(1),
+                    output_field=IntegerField(),
+                )
+            ).order_by('rank', 'search_name')
+        return queryset[:self.get_limit(request)]
+
+
+class RecipeOrderingFilter(BaseFilterBackend):
+    ordering_param = 'ordering'
+    orderings = {
+        'popular': ('-favorites_count', '-pub_date', '-id'),
+        'trending': ('-trending_score', '-pub_date', '-id'),
+    }
+
+    @classmethod
+    def is_requested(cls, request):
+        return request.query_params.get(cls.ordering_param) in cls.orderings
+
+    @classmethod
+    def get_ordering(cls, request):
+        return cls.orderings.get(
+            request.query_params.get(cls.ordering_param),
+            Recipe._meta.ordering,
+        )
+
+    def filter_queryset(self, request, queryset, view):
+        return queryset.order_by(*self.get_ordering(request))
+
+
+class RecipeSearchFilter(BaseFilterBackend):
+    """Полнотекстовый поиск, результаты упорядочены по рангу.
+
+    При курсорной пагинации поиск только отбирает рецепты: курсор
+    строится по полям сортировки ленты, поэтому ранг не учитывается
+    и порядок совпадает с обычным выводом.
+    """
+    search_param = 'search'
+    ordering = ('-rank', '-pub_date', '-id')
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+        queryset = search_recipes(queryset, query)
+        if (RecipeOrderingFilter.is_requested(request)
+                or KeysetPagination.is_requested(request)):
+            return queryset
+        return queryset.order_by(*self.ordering)
@@ -0,0 +1,102 @@
+import io
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import Recipe
+
+VARIANTS_DIR = 'recipes/variants'
+IMAGE_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+
+def get_variant_name(source, variant, extension):
+    stem = os.path.splitext(os.path.basename(source))[0]
+    return f'{VARIANTS_DIR}/{stem}_{variant}.{extension}'
+
+
+def get_image_variants(source):
+    return {
+        variant: {
+            extension: get_variant_name(source, variant, extension)
+            for extension in IMAGE_FORMATS
+        }
+        for variant in settings.RECIPE_IMAGE_VARIANTS
+    }
+
+
+def get_variant_files(source):
+    return [
+        name
+        for formats in get_image_variants(source).values()
+        for name in formats.values()
+    ]
+
+
+def release_image(source):
+    """Удаляет картинку и её копии, если на неё не ссылается ни один рецепт.
+
+    Картинки хранятся по хешу содержимого и могут быть общими
+    у нескольких рецептов. Картинку, использованную за последние
+    RECIPE_IMAGE_RELEASE_GRACE секунд, может уже сохранять другой
+    рецепт в незавершённой транзакции: она остаётся на месте, и
+    если не понадобится, её удалит collect_media_garbage.
+    """
+    references = Recipe.objects.filter(image=source)
+    if not source or references.exists():
+        return
+    if not Recipe.image.field.storage.release(
+        source, references.exists, settings.RECIPE_IMAGE_RELEASE_GRACE
+    ):
+        return
+    for name in get_variant_files(source):
+        default_storage.delete(name)
+
+
+def render_variants(source):
+    """Уменьшенные копии картинки во всех размерах и форматах.
+
+    Ориентация из EXIF применяется к пикселям, сами метаданные
+    в копии не переносятся.
+    """
+    with Recipe.image.field.storage.open(source) as file, \
+            Image.open(file) as image:
+        image = ImageOps.exif_transpose(image).convert('RGB')
+    for variant, max_side in settings.RECIPE_IMAGE_VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((max_side, max_side), Image.LANCZOS)
+        for extension, (image_format, options) in IMAGE_FORMATS.items():
+            buffer = io.BytesIO()
+            resized.save(buffer, image_format, **options)
+            yield variant, extension, buffer.getvalue()
+
+
+def build_image_variants(recipe_id, force=False):
+    """Создаёт недостающие копии картинки рецепта.
+
+    С force копии пересоздаются, даже если файлы уже есть, например
+    после смены размеров или настроек сжатия.
+    """
+    recipe = Recipe.objects.filter(pk=recipe_id).only('image').first()
+    if recipe is None or not recipe.image:
+        return
+    source = recipe.image.name
+    variants = get_image_variants(source)
+    files = get_variant_files(source)
+    if force or not all(map(default_storage.exists, files)):
+        for variant, extension, content in render_variants(source):
+            name = variants[variant][extension]
+            if default_storage.exists(name):
+                if not force:
+                    continue
+                default_storage.delete(name)
+            default_storage.save(name, ContentFile(content))
+    Recipe.objects.filter(pk=recipe_id, image=source).update(
+        image_variants=variants, modified=timezone.now()
+    )
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет время типовых запросов на синтетических данных. '
+        'Данные создаются в транзакции, которая затем откатывается'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'names',
+            nargs='*',
+            help=f'Замеры: {", ".join(sorted(BENCHMARKS))}. По умолчанию все',
+        )
+        parser.add_argument(
+            '--size',
+            type=int,
+            help='Размер данных, по умолчанию свой у каждого замера',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Количество повторов, выводится медиана и минимум',
+        )
+
+    def handle(self, *args, names, size, repeat, **options):
+        unknown = set(names) - BENCHMARKS.keys()
+        if unknown:
+            raise CommandError(f'Неизвестные замеры: {", ".join(unknown)}')
+        for name in names or sorted(BENCHMARKS):
+            func, default_size = BENCHMARKS[name]
+            with transaction.atomic():
+                results = func(size or default_size, repeat)
+                transaction.set_rollback(True)
+            for label, median_time, min_time, queries in results:
+                self.stdout.write(
+                    f'{name}: {label} — медиана {median_time * 1000:.1f} мс, '
+                    f'минимум {min_time * 1000:.1f} мс, запросов {queries}'
+                )
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import build_image_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Создаёт уменьшенные копии картинок рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Пересоздать копии и для рецептов, у которых они уже есть',
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(image_variants={})
+        count = 0
+        for recipe_id in recipes.values_list('id', flat=True).iterator():
+            build_image_variants(recipe_id, force=options['all'])
+            count += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано рецептов: {count}'
+        ))
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import ShoplistIngredient
+from recipes.utils import get_expected_shopping_totals
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = 'Сверяет итоги списков покупок с корзинами пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Пересобрать таблицу итогов, если найдены расхождения',
+        )
+
+    def handle(self, *args, **options):
+        expected = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount
+            in get_expected_shopping_totals()
+        }
+        actual = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount
+            in ShoplistIngredient.objects.values_list(
+                'user_id', 'ingredient_id', 'amount'
+            ).iterator()
+        }
+        mismatches = sum(
+            expected.get(key) != actual.get(key)
+            for key in expected.keys() | actual.keys()
+        )
+        self.stdout.write(f'Найдено расхождений: {mismatches}')
+        if not mismatches or not options['rebuild']:
+            return
+        with transaction.atomic():
+            ShoplistIngredient.objects.all().delete()
+            ShoplistIngredient.objects.bulk_create(
+                (
+                    ShoplistIngredient(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        amount=amount,
+                    )
+                    for (user_id, ingredient_id), amount in expected.items()
+                ),
+                batch_size=BATCH_SIZE,
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Таблица итогов пересобрана: {len(expected)} записей'
+        ))
@@ -0,0 +1,58 @@
+import os
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.images import get_variant_files
+from recipes.models import Recipe
+
+MEDIA_DIR = 'recipes'
+
+
+def walk(storage, path):
+    directories, files = storage.listdir(path)
+    for name in files:
+        yield os.path.join(path, name)
+    for directory in directories:
+        yield from walk(storage, os.path.join(path, directory))
+
+
+class Command(BaseCommand):
+    help = 'Удаляет картинки рецептов, на которые не ссылается ни один рецепт'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-hours',
+            type=int,
+            default=24,
+            help='Не трогать файлы моложе указанного числа часов',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать файлы, которые будут удалены',
+        )
+
+    def handle(self, *args, **options):
+        if not default_storage.exists(MEDIA_DIR):
+            return
+        referenced = set()
+        for image in Recipe.objects.values_list('image', flat=True).iterator():
+            referenced.add(image)
+            referenced.update(get_variant_files(image))
+        deadline = timezone.now() - timedelta(hours=options['grace_hours'])
+        count = 0
+        for name in walk(default_storage, MEDIA_DIR):
+            if (name in referenced
+                    or default_storage.get_modified_time(name) > deadline):
+                continue
+            count += 1
+            if options['dry_run']:
+                self.stdout.write(name)
+            else:
+                default_storage.delete(name)
+        self.stdout.write(self.style.SUCCESS(
+            f'Файлов без ссылок: {count}'
+        ))
@@ -0,0 +1,85 @@
+import json
+import os
+import shutil
+
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+
+from recipes.models import CountOfIngredient, Recipe, Tag
+
+RECIPES_FILE = 'recipes.jsonl'
+IMAGES_DIR = 'images'
+
+
+def get_recipe_data(recipe):
+    return {
+        'author': recipe.author.email,
+        'name': recipe.name,
+        'text': recipe.text,
+        'cooking_time': recipe.cooking_time,
+        'pub_date': recipe.pub_date.isoformat(),
+        'image': os.path.basename(recipe.image.name),
+        'tags': [
+            {'name': tag.name, 'color': tag.color, 'slug': tag.slug}
+            for tag in recipe.tags.all()
+        ],
+        'ingredients': [
+            {
+                'name': amount.ingredients.name,
+                'measurement_unit': amount.ingredients.measurement_unit,
+                'amount': amount.amount,
+            }
+            for amount in recipe.recipe_ingredients.all()
+        ],
+    }
+
+
+class Command(BaseCommand):
+    help = 'Выгружает рецепты в JSON Lines вместе с картинками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Каталог для выгрузки')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Количество рецептов, читаемых из базы за раз',
+        )
+
+    def iter_recipes(self, batch_size):
+        recipes = Recipe.objects.select_related('author').prefetch_related(
+            Prefetch('tags', queryset=Tag.objects.all()),
+            Prefetch(
+                'recipe_ingredients',
+                queryset=CountOfIngredient.objects.select_related(
+                    'ingredients'
+                ),
+            ),
+        ).defer('search_vector').order_by('pk')
+        last_pk = 0
+        while True:
+            batch = list(recipes.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                return
+            yield from batch
+            last_pk = batch[-1].pk
+
+    def handle(self, *args, path, batch_size, **options):
+        images_path = os.path.join(path, IMAGES_DIR)
+        os.makedirs(images_path, exist_ok=True)
+        count = 0
+        with open(
+            os.path.join(path, RECIPES_FILE), 'w', encoding='utf-8'
+        ) as file:
+            for recipe in self.iter_recipes(batch_size):
+                data = get_recipe_data(recipe)
+                image_path = os.path.join(images_path, data['image'])
+                if data['image'] and not os.path.exists(image_path):
+                    with recipe.image.open('rb') as source, \
+                            open(image_path, 'wb') as target:
+                        shutil.copyfileobj(source, target)
+                file.write(json.dumps(data, ensure_ascii=False) + '\n')
+                count += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Выгружено рецептов: {count}'
+        ))
@@ -0,0 +1,166 @@
+import json
+import os
+
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils.dateparse import parse_datetime
+
+from recipes.catalog import catalog
+from recipes.images import build_image_variants
+from recipes.models import (CountOfIngredient, Ingredient, Recipe, Tag,
+                            TimelineEntry)
+from recipes.tasks import enqueue
+from users.models import CustomUser
+
+from .export_recipes import IMAGES_DIR, RECIPES_FILE
+
+CHECKPOINT_FILE = '.import_checkpoint'
+
+
+class Command(BaseCommand):
+    help = 'Загружает рецепты, выгруженные командой export_recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Каталог с выгрузкой')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Количество рецептов в одной транзакции',
+        )
+        parser.add_argument(
+            '--default-author',
+            help='Email автора для рецептов, чьих авторов нет в базе',
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Начать загрузку сначала, не учитывая контрольную точку',
+        )
+
+    def read_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as file:
+                return int(file.read())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def write_checkpoint(self, line):
+        temporary_path = f'{self.checkpoint_path}.tmp'
+        with open(temporary_path, 'w') as file:
+            file.write(str(line))
+        os.replace(temporary_path, self.checkpoint_path)
+
+    def load_lookups(self, default_author):
+        self.authors = dict(CustomUser.objects.values_list('email', 'id'))
+        self.default_author = None
+        if default_author is not None:
+            self.default_author = self.authors.get(default_author)
+            if self.default_author is None:
+                raise CommandError(f'Пользователь {default_author} не найден')
+        self.tags = dict(Tag.objects.values_list('slug', 'id'))
+        self.ingredients = {
+            (name, measurement_unit): pk
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            ).iterator()
+        }
+
+    def get_author_id(self, email):
+        author_id = self.authors.get(email, self.default_author)
+        if author_id is None:
+            raise CommandError(f'Автор {email} не найден')
+        return author_id
+
+    def get_tag_ids(self, tags):
+        for tag in tags:
+            if tag['slug'] not in self.tags:
+                self.tags[tag['slug']] = Tag.objects.create(**tag).pk
+        return [self.tags[tag['slug']] for tag in tags]
+
+    def get_ingredient_id(self, name, measurement_unit):
+        key = (name, measurement_unit)
+        if key not in self.ingredients:
+            self.ingredients[key] = Ingredient.objects.create(
+                name=name, measurement_unit=measurement_unit,
+            ).pk
+        return self.ingredients[key]
+
+    def create_recipe(self, data, author_id):
+        path = os.path.join(self.images_path, data['image'])
+        with open(path, 'rb') as image:
+            recipe = Recipe.objects.create(
+                author_id=author_id,
+                name=data['name'],
+                text=data['text'],
+                cooking_time=data['cooking_time'],
+                image=File(image, name=data['image']),
+            )
+        recipe.tags.set(self.get_tag_ids(data['tags']))
+        CountOfIngredient.objects.bulk_create(
+            CountOfIngredient(
+                recipe=recipe,
+                ingredients_id=self.get_ingredient_id(
+                    item['name'], item['measurement_unit']
+                ),
+                amount=item['amount'],
+            )
+            for item in data['ingredients']
+        )
+        Recipe.objects.filter(pk=recipe.pk).update(
+            pub_date=parse_datetime(data['pub_date'])
+        )
+        enqueue(build_image_variants, recipe.pk)
+        return recipe.pk
+
+    @transaction.atomic
+    def import_batch(self, batch):
+        """Загружает пакет, пропуская рецепты, которые уже есть в базе."""
+        keys = [
+            (self.get_author_id(data['author']), data['name'])
+            for data in batch
+        ]
+        existing = set(Recipe.objects.filter(
+            author_id__in={author_id for author_id, _ in keys},
+            name__in={name for _, name in keys},
+        ).values_list('author_id', 'name'))
+        recipe_ids = []
+        for key, data in zip(keys, batch):
+            if key not in existing:
+                existing.add(key)
+                recipe_ids.append(self.create_recipe(data, key[0]))
+        TimelineEntry.objects.filter(recipe_id__in=recipe_ids).update(
+            pub_date=Subquery(
+                Recipe.objects.filter(pk=OuterRef('recipe_id'))
+                .values('pub_date')
+            )
+        )
+        return len(recipe_ids)
+
+    def handle(self, *args, path, batch_size, **options):
+        self.images_path = os.path.join(path, IMAGES_DIR)
+        self.checkpoint_path = os.path.join(path, CHECKPOINT_FILE)
+        self.load_lookups(options['default_author'])
+        done = 0 if options['restart'] else self.read_checkpoint()
+        line = 0
+        imported = 0
+        batch = []
+        with open(os.path.join(path, RECIPES_FILE), encoding='utf-8') as file:
+            for line, text in enumerate(file, start=1):
+                if line <= done:
+                    continue
+                batch.append(json.loads(text))
+                if len(batch) >= batch_size:
+                    imported += self.import_batch(batch)
+                    self.write_checkpoint(line)
+                    batch = []
+            if batch:
+                imported += self.import_batch(batch)
+                self.write_checkpoint(line)
+        catalog.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено рецептов: {imported}, строк пропущено по '
+            f'контрольной точке: {min(done, line)}'
+        ))
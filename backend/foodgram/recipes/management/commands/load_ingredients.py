@@ -0,0 +1,105 @@
+import csv
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.catalog import catalog
+from recipes.models import Ingredient, normalize_search
+
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if len(row) >= 2:
+            yield row[0], row[1]
+
+
+def read_json(file):
+    """Элементы JSON-массива по одному, без чтения файла целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    while True:
+        chunk = file.read(JSON_CHUNK_SIZE)
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not started and buffer[position:position + 1] == '[':
+                started = True
+                position += 1
+                continue
+            if buffer[position:position + 1] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except ValueError:
+                break
+            yield item['name'], item['measurement_unit']
+        if not chunk:
+            if buffer[position:].strip():
+                raise CommandError('Файл JSON обрывается на середине')
+            return
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+}
+
+
+class Command(BaseCommand):
+    help = 'Загружает ингредиенты из CSV или JSON пакетами'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу .csv или .json')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Количество строк в одном INSERT',
+        )
+
+    def insert(self, batch):
+        Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+        batch.clear()
+
+    def handle(self, *args, path, batch_size, **options):
+        reader = READERS.get(os.path.splitext(path)[1].lower())
+        if reader is None:
+            raise CommandError('Поддерживаются только файлы .csv и .json')
+        started = time.monotonic()
+        before = Ingredient.objects.count()
+        seen = set()
+        batch = []
+        rows = 0
+        with open(path, encoding='utf-8') as file:
+            for name, measurement_unit in reader(file):
+                rows += 1
+                name = ' '.join(name.split())
+                measurement_unit = measurement_unit.strip()
+                key = (name, measurement_unit)
+                if not name or key in seen:
+                    continue
+                seen.add(key)
+                batch.append(Ingredient(
+                    name=name,
+                    measurement_unit=measurement_unit,
+                    search_name=normalize_search(name),
+                ))
+                if len(batch) >= batch_size:
+                    self.insert(batch)
+        self.insert(batch)
+        catalog.invalidate()
+        created = Ingredient.objects.count() - before
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано строк: {rows}, уникальных: {len(seen)}, '
+            f'добавлено: {created} за {elapsed:.2f} с '
+            f'({rows / max(elapsed, 1e-6):.0f} строк/с)'
+        ))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.utils import recount_recipe_counters, recount_user_counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики избранного, покупок, подписчиков и рецептов'
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        recipes = recount_recipe_counters()
+        users = recount_user_counters()
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано рецептов: {recipes}, пользователей: {users}'
+        ))
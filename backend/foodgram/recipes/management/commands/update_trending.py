@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.utils import update_trending_scores
+
+
+class Command(BaseCommand):
+    help = 'Обновляет рейтинг популярности рецептов за последнее время'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Пересчитать рейтинг по всем событиям с нуля',
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        recipes = update_trending_scores(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Обновлён рейтинг рецептов: {recipes}'
+        ))
@@ -0,0 +1,62 @@
+# Generated by Django 3.2 on 2026-10-18 19:19
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_shopping_totals(apps, schema_editor):
+    CountOfIngredient = apps.get_model('recipes', 'CountOfIngredient')
+    ShoplistIngredient = apps.get_model('recipes', 'ShoplistIngredient')
+    totals = (
+        CountOfIngredient.objects
+        .filter(recipe__shopping_cart__isnull=False)
+        .values_list('recipe__shopping_cart__user', 'ingredients')
+        .annotate(amount=models.Sum('amount'))
+        .order_by()
+    )
+    ShoplistIngredient.objects.bulk_create(
+        (
+            ShoplistIngredient(
+                user_id=user_id, ingredient_id=ingredient_id, amount=amount
+            )
+            for user_id, ingredient_id, amount in totals.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(default='', upload_to='recipes/', verbose_name='Картинка'),
+            preserve_default=False,
+        ),
+        migrations.CreateModel(
+            name='ShoplistIngredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.IntegerField(default=0, verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_cart_ingredients', to='recipes.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_cart_ingredients', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Ингредиент списка покупок',
+                'verbose_name_plural': 'Ингредиенты списков покупок',
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoplistingredient',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique cart ingredient'),
+        ),
+        migrations.RunPython(fill_shopping_totals, migrations.RunPython.noop),
+    ]
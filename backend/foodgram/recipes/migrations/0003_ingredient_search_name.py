@@ -0,0 +1,59 @@
+# Generated by Django 3.2 on 2026-10-18 19:21
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def fill_search_name(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    batch = []
+    for ingredient in Ingredient.objects.only('id', 'name').iterator():
+        ingredient.search_name = ' '.join(
+            ingredient.name.lower().replace('ё', 'е').split()
+        )
+        batch.append(ingredient)
+        if len(batch) == BATCH_SIZE:
+            Ingredient.objects.bulk_update(batch, ['search_name'])
+            batch = []
+    Ingredient.objects.bulk_update(batch, ['search_name'])
+
+
+def create_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS ingredient_search_name_trgm_idx '
+        'ON recipes_ingredient USING gin (search_name gin_trgm_ops)'
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'DROP INDEX IF EXISTS ingredient_search_name_trgm_idx'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_shoplistingredient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='search_name',
+            field=models.CharField(default='', editable=False, max_length=200, verbose_name='Название для поиска'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_search_name, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(fields=['search_name'], name='ingredient_search_name_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2 on 2026-10-18 19:23
+
+from django.db import migrations, models
+
+
+def copy_pub_date(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Recipe.objects.update(modified=models.F('pub_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_ingredient_search_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, verbose_name='Дата изменения'),
+        ),
+        migrations.RunPython(copy_pub_date, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 3.2 on 2026-10-18 19:26
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def count_related(model, field):
+    return Coalesce(models.Subquery(
+        model.objects
+        .filter(**{field: models.OuterRef('pk')})
+        .order_by()
+        .values(field)
+        .annotate(count=models.Count('pk'))
+        .values('count')
+    ), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipesFavorite = apps.get_model('recipes', 'RecipesFavorite')
+    Shoplist = apps.get_model('recipes', 'Shoplist')
+    CustomUser = apps.get_model('users', 'CustomUser')
+    Subscribe = apps.get_model('users', 'Subscribe')
+    Recipe.objects.update(
+        favorites_count=count_related(RecipesFavorite, 'recipe'),
+        shopping_cart_count=count_related(Shoplist, 'recipe'),
+    )
+    CustomUser.objects.update(
+        followers_count=count_related(Subscribe, 'author'),
+        recipes_count=count_related(Recipe, 'author'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_recipe_pub_date_id_idx'),
+        ('users', '0003_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_cart_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='В списках покупок'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-pub_date', '-id'], name='recipe_popular_idx'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
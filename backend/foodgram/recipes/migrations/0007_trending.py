@@ -0,0 +1,40 @@
+# Generated by Django 3.2 on 2026-10-18 19:27
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='trending_score',
+            field=models.FloatField(default=0, verbose_name='Рейтинг популярности'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='trending_updated',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Дата расчёта рейтинга'),
+        ),
+        migrations.AddField(
+            model_name='recipesfavorite',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='shoplist',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-trending_score', '-pub_date', '-id'], name='recipe_trending_idx'),
+        ),
+    ]
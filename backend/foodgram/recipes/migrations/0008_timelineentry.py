@@ -0,0 +1,75 @@
+# Generated by Django 3.2 on 2026-10-18 19:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_timeline(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Subscribe = apps.get_model('users', 'Subscribe')
+    TimelineEntry = apps.get_model('recipes', 'TimelineEntry')
+    recipes = {}
+    entries = []
+    for user_id, author_id in Subscribe.objects.filter(
+        author__followers_count__lt=settings.FEED_CELEBRITY_FOLLOWERS
+    ).values_list('user_id', 'author_id').iterator():
+        if author_id not in recipes:
+            recipes[author_id] = list(
+                Recipe.objects
+                .filter(author_id=author_id)
+                .order_by('-pub_date', '-id')
+                .values_list('id', 'pub_date')[:settings.FEED_BACKFILL_LIMIT]
+            )
+        entries.extend(
+            TimelineEntry(
+                user_id=user_id,
+                recipe_id=recipe_id,
+                author_id=author_id,
+                pub_date=pub_date,
+            )
+            for recipe_id, pub_date in recipes[author_id]
+        )
+        if len(entries) >= 1000:
+            TimelineEntry.objects.bulk_create(entries)
+            entries = []
+    TimelineEntry.objects.bulk_create(entries)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0007_trending'),
+        ('users', '0003_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_date', models.DateTimeField(verbose_name='Дата публикации')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='recipes.recipe', verbose_name='Рецепт')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL, verbose_name='Подписчик')),
+            ],
+            options={
+                'verbose_name': 'Запись ленты',
+                'verbose_name_plural': 'Записи ленты',
+                'ordering': ['-pub_date', '-recipe'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', '-pub_date', '-recipe'], name='timeline_user_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', 'author'], name='timeline_user_author_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='timelineentry',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique timeline recipe'),
+        ),
+        migrations.RunPython(fill_timeline, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.2 on 2026-10-18 19:31
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        "UPDATE recipes_recipe AS recipe SET search_vector = "
+        "setweight(to_tsvector('russian', recipe.name), 'A') || "
+        "setweight(to_tsvector('russian', coalesce(("
+        "SELECT string_agg(ingredient.name, ' ') "
+        "FROM recipes_countofingredient AS amount "
+        "JOIN recipes_ingredient AS ingredient "
+        "ON ingredient.id = amount.ingredients_id "
+        "WHERE amount.recipe_id = recipe.id), '')), 'B') || "
+        "setweight(to_tsvector('russian', recipe.text), 'C')"
+    )
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS recipe_search_vector_idx '
+        'ON recipes_recipe USING gin (search_vector)'
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS recipe_search_vector_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
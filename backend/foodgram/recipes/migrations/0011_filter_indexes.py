@@ -0,0 +1,21 @@
+# Generated by Django 3.2 on 2026-10-18 19:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_recipe_tags_tag_recipe_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-pub_date', '-id'], name='recipe_author_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipesfavorite',
+            index=models.Index(fields=['user', 'recipe'], name='favorite_user_recipe_idx'),
+        ),
+    ]
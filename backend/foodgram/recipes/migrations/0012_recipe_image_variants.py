@@ -0,0 +1,18 @@
+# Generated by Django 3.2 on 2026-10-18 19:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_variants',
+            field=models.JSONField(default=dict, editable=False, verbose_name='Уменьшенные копии картинки'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2 on 2026-10-18 19:39
+
+from django.db import migrations, models
+import recipes.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(db_index=True, storage=recipes.storage.ContentAddressedStorage(), upload_to='recipes/', verbose_name='Картинка'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 3.2 on 2026-10-18 19:39
+
+from django.db import migrations, models
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    references = (
+        (apps.get_model('recipes', 'CountOfIngredient'),
+         'recipe_id', 'ingredients_id'),
+        (apps.get_model('recipes', 'ShoplistIngredient'),
+         'user_id', 'ingredient_id'),
+    )
+    duplicates = (
+        Ingredient.objects
+        .values('name', 'measurement_unit')
+        .annotate(keep=models.Min('id'), count=models.Count('id'))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    for group in duplicates:
+        others = list(
+            Ingredient.objects
+            .filter(name=group['name'],
+                    measurement_unit=group['measurement_unit'])
+            .exclude(pk=group['keep'])
+            .values_list('id', flat=True)
+        )
+        for model, owner, field in references:
+            for row in model.objects.filter(**{f'{field}__in': others}):
+                kept = model.objects.filter(**{
+                    owner: getattr(row, owner), field: group['keep']
+                }).first()
+                if kept is None:
+                    setattr(row, field, group['keep'])
+                    row.save()
+                else:
+                    kept.amount += row.amount
+                    kept.save()
+                    row.delete()
+        Ingredient.objects.filter(pk__in=others).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_recipe_image_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique ingredient'),
+        ),
+    ]
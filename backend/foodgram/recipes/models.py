@@ -1,10 +1,16 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.core import validators
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models import (Count, Exists, F, OuterRef, Prefetch, Subquery,
+                              Window)
+from django.db.models.functions import Coalesce, RowNumber
 from django.urls import reverse
 
 from users.models import CustomUser
 
+from .storage import recipe_image_storage
+
 User = CustomUser()
 
 COOKING_TIME_ERROR = 'Время приготовления не может быть меньше одной минуты'
@@ -40,6 +46,10 @@ class Tag(models.Model):
         return reverse('tag', args=[self.slug])
 
 
+def normalize_search(value):
+    return ' '.join(value.lower().replace('ё', 'е').split())
+
+
 class Ingredient(models.Model):
     name = models.CharField(
         max_length=200,
@@ -49,15 +59,103 @@ class Ingredient(models.Model):
         max_length=10,
         verbose_name='Единица измерения'
     )
+    search_name = models.CharField(
+        max_length=200,
+        editable=False,
+        verbose_name='Название для поиска',
+    )
 
     class Meta:
         ordering = ('name', )
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = (
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique ingredient',
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=['search_name'],
+                name='ingredient_search_name_idx',
+                opclasses=['varchar_pattern_ops'],
+            ),
+        )
 
     def __str__(self):
         return f'{self.name}, {self.measurement_unit}.'
 
+    def save(self, *args, **kwargs):
+        self.search_name = normalize_search(self.name)
+        super().save(*args, **kwargs)
+
+
+def get_recipe_prefetches():
+    return (
+        Prefetch('tags', queryset=Tag.objects.only('id')),
+        Prefetch(
+            'recipe_ingredients',
+            queryset=CountOfIngredient.objects.select_related('ingredients'),
+        ),
+    )
+
+
+class RecipeQuerySet(models.QuerySet):
+    def with_author(self):
+        return self.defer('search_vector').select_related('author')
+
+    def with_related(self):
+        return self.with_author().prefetch_related(*get_recipe_prefetches())
+
+    def latest_for_authors(self, author_ids, limit=None):
+        queryset = self.filter(author_id__in=author_ids)
+        if limit is None:
+            return queryset
+        ranked = queryset.annotate(row_number=Window(
+            expression=RowNumber(),
+            partition_by=[F('author_id')],
+            order_by=[F('pub_date').desc(), F('id').desc()],
+        ))
+        sql, params = ranked.query.sql_with_params()
+        return self.raw(
+            f'SELECT * FROM ({sql}) ranked WHERE row_number <= %s '
+            'ORDER BY author_id, pub_date DESC, id DESC',
+            [*params, limit],
+        )
+
+    def with_user_flags(self, user):
+        if user.is_anonymous:
+            return self
+        return self.annotate(
+            is_favorited=Exists(RecipesFavorite.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            is_in_shopping_cart=Exists(Shoplist.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+        )
+
+    def cookable_with(self, ingredient_ids):
+        """Рецепты хотя бы с одним из ингредиентов и их покрытие.
+
+        Кандидаты выбираются по индексу ингредиентов в
+        CountOfIngredient, covered и missing считаются подзапросами
+        только для найденных рецептов.
+        """
+        amounts = CountOfIngredient.objects.filter(
+            recipe=OuterRef('pk')
+        ).order_by().values('recipe').annotate(count=Count('pk'))
+        return self.filter(pk__in=CountOfIngredient.objects.filter(
+            ingredients__in=ingredient_ids
+        ).values('recipe')).annotate(
+            covered=Subquery(
+                amounts.filter(ingredients__in=ingredient_ids).values('count')
+            ),
+            missing=Coalesce(Subquery(amounts.values('count')), 0)
+            - F('covered'),
+        )
+
 
 class Recipe(models.Model):
     author = models.ForeignKey(
@@ -92,20 +190,72 @@ class Recipe(models.Model):
     )
     image = models.ImageField(
         verbose_name='Картинка',
-        upload_to='recipes/'
+        upload_to='recipes/',
+        storage=recipe_image_storage,
+        db_index=True,
+    )
+    image_variants = models.JSONField(
+        verbose_name='Уменьшенные копии картинки',
+        default=dict,
+        editable=False,
     )
     pub_date = models.DateTimeField(
         verbose_name='Дата публикации',
         auto_now_add=True,
     )
+    modified = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        verbose_name='В списках покупок',
+        default=0,
+    )
+    trending_score = models.FloatField(
+        verbose_name='Рейтинг популярности',
+        default=0,
+    )
+    trending_updated = models.DateTimeField(
+        verbose_name='Дата расчёта рейтинга',
+        null=True,
+        blank=True,
+    )
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый вектор',
+        null=True,
+        editable=False,
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
-        ordering = ['-pub_date']
+        ordering = ['-pub_date', '-id']
         constraints = [
             models.UniqueConstraint(
                 fields=['author', 'name'], name='unique_recipe'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'], name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=['-favorites_count', '-pub_date', '-id'],
+                name='recipe_popular_idx',
+            ),
+            models.Index(
+                fields=['-trending_score', '-pub_date', '-id'],
+                name='recipe_trending_idx',
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='recipe_author_pub_date_idx',
+            ),
+        ]
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
 
@@ -129,6 +279,10 @@ class RecipesFavorite(models.Model):
         null=False,
         related_name='recipes_favorite',
     )
+    created = models.DateTimeField(
+        verbose_name='Дата добавления',
+        auto_now_add=True,
+    )
 
     class Meta:
         constraints = [
@@ -137,6 +291,12 @@ class RecipesFavorite(models.Model):
                 name='unique_favorite'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['user', 'recipe'],
+                name='favorite_user_recipe_idx',
+            ),
+        ]
 
 
 class CountOfIngredient(models.Model):
@@ -194,6 +354,10 @@ class Shoplist(models.Model):
         related_name='shopping_cart',
         verbose_name='Рецепты',
     )
+    created = models.DateTimeField(
+        verbose_name='Дата добавления',
+        auto_now_add=True,
+    )
 
     class Meta:
         ordering = ['-id']
@@ -203,3 +367,81 @@ class Shoplist(models.Model):
             models.UniqueConstraint(fields=['user', 'recipe'],
                                     name='unique cart user')
         ]
+
+
+class ShoplistIngredient(models.Model):
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_ingredients',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_ingredients',
+        verbose_name='Ингредиент',
+    )
+    amount = models.IntegerField(
+        verbose_name='Количество',
+        default=0,
+    )
+
+    class Meta:
+        ordering = ['-id']
+        verbose_name = 'Ингредиент списка покупок'
+        verbose_name_plural = 'Ингредиенты списков покупок'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'ingredient'],
+                                    name='unique cart ingredient')
+        ]
+
+    def __str__(self):
+        return f'{self.user} - {self.ingredient} {self.amount}'
+
+
+class TimelineEntry(models.Model):
+    """Рецепт в ленте подписчика, записывается при публикации."""
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Подписчик',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Рецепт',
+    )
+    author = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор',
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации',
+    )
+
+    class Meta:
+        ordering = ['-pub_date', '-recipe']
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'recipe'],
+                                    name='unique timeline recipe')
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='timeline_user_pub_date_idx',
+            ),
+            models.Index(
+                fields=['user', 'author'],
+                name='timeline_user_author_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user} - {self.recipe}'
@@ -0,0 +1,43 @@
+from django.conf import settings
+from rest_framework import parsers, status
+from rest_framework.exceptions import APIException
+
+
+class PayloadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Слишком большой запрос'
+    default_code = 'payload_too_large'
+
+
+class UploadSizeLimitMixin:
+    """Отклоняет запрос по заголовку Content-Length до чтения тела."""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        if length > settings.RECIPE_UPLOAD_MAX_SIZE:
+            raise PayloadTooLarge
+        return super().parse(stream, media_type, parser_context)
+
+
+class RecipeJSONParser(UploadSizeLimitMixin, parsers.JSONParser):
+    """JSON с картинкой строкой base64.
+
+    Тело запроса читается и разбирается целиком, частями
+    раскодируется только сама картинка. Большие картинки лучше
+    загружать файлом в multipart-запросе.
+    """
+
+
+class RecipeMultiPartParser(UploadSizeLimitMixin, parsers.MultiPartParser):
+    pass
+
+
+class RecipeFormParser(UploadSizeLimitMixin, parsers.FormParser):
+    pass
+
+
+RECIPE_PARSERS = (RecipeJSONParser, RecipeFormParser, RecipeMultiPartParser)
@@ -0,0 +1,36 @@
+from rest_framework.renderers import JSONRenderer
+
+
+class ShoppingListRenderer(JSONRenderer):
+    """Выбор формата списка покупок.
+
+    Сам список отдаётся потоковым ответом в обход рендерера,
+    через render() проходят только ответы с ошибками.
+    """
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class ShoppingListJSONRenderer(ShoppingListRenderer):
+    format = 'json'
+
+
+class ShoppingListPDFRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+
+
+SHOPPING_LIST_RENDERERS = (
+    ShoppingListTextRenderer,
+    ShoppingListCSVRenderer,
+    ShoppingListJSONRenderer,
+    ShoppingListPDFRenderer,
+)
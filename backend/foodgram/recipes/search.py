@@ -0,0 +1,142 @@
+from collections import defaultdict
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection
+from django.db.models import (Case, F, FloatField, Func, OuterRef, Q,
+                              Subquery, TextField, Value, When)
+from django.db.models.functions import Coalesce
+
+from .models import CountOfIngredient, Recipe, normalize_search
+
+SEARCH_CONFIG = 'russian'
+FALLBACK_WEIGHTS = {'name': 1.0, 'ingredients': 0.4, 'text': 0.2}
+FALLBACK_STEM_LENGTH = 4
+
+
+def is_postgresql():
+    return connection.vendor == 'postgresql'
+
+
+def get_ingredient_names():
+    return Coalesce(Subquery(
+        CountOfIngredient.objects
+        .filter(recipe=OuterRef('pk'))
+        .order_by()
+        .values('recipe')
+        .annotate(names=StringAgg('ingredients__name', ' '))
+        .values('names')
+    ), Value(''))
+
+
+def update_search_vectors(queryset):
+    if not is_postgresql():
+        return
+    queryset.update(search_vector=(
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector(get_ingredient_names(), weight='B',
+                       config=SEARCH_CONFIG)
+        + SearchVector('text', weight='C', config=SEARCH_CONFIG)
+    ))
+
+
+class NormalizeSearch(Func):
+    """normalize_search() в SQLite, функция регистрируется в signals."""
+    function = 'normalize_search'
+    output_field = TextField()
+
+
+def get_fallback_candidates(stems):
+    """Рецепты, в которых встречается каждая основа запроса.
+
+    Отбор выполняется в базе и пропускает только те рецепты, для
+    которых стоит считать ранг. В SQLite LIKE не учитывает регистр
+    только для ASCII, поэтому название и текст нормализуются
+    функцией; другие базы полагаются на регистронезависимое
+    сравнение своей сортировки.
+    """
+    queryset = Recipe.objects.all()
+    if connection.vendor == 'sqlite':
+        queryset = queryset.annotate(
+            search_name=NormalizeSearch('name'),
+            search_text=NormalizeSearch('text'),
+        )
+        fields = ('search_name__contains', 'search_text__contains')
+    else:
+        fields = ('name__icontains', 'text__icontains')
+    for stem in stems:
+        condition = Q(pk__in=CountOfIngredient.objects.filter(
+            ingredients__search_name__contains=stem
+        ).values('recipe'))
+        for field in fields:
+            condition |= Q(**{field: stem})
+        queryset = queryset.filter(condition)
+    return queryset
+
+
+def get_stem(term):
+    """Грубая замена стемминга: отбрасывает окончание длинных слов."""
+    if len(term) <= FALLBACK_STEM_LENGTH:
+        return term
+    return term[:max(FALLBACK_STEM_LENGTH, len(term) - 2)]
+
+
+def get_fallback_ranks(value):
+    """Поиск в памяти процесса для баз без полнотекстового поиска.
+
+    Документ подходит, если каждое слово запроса совпадает с началом
+    какого-либо слова названия, текста или ингредиентов. Ранг
+    считается только для рецептов, отобранных в базе по вхождению
+    основ.
+    """
+    stems = [get_stem(term) for term in normalize_search(value).split()]
+    if not stems:
+        return {}
+    candidates = get_fallback_candidates(stems)
+    documents = defaultdict(dict)
+    for pk, name, text in candidates.values_list(
+        'id', 'name', 'text'
+    ).iterator():
+        documents[pk]['name'] = normalize_search(name).split()
+        documents[pk]['text'] = normalize_search(text).split()
+    for pk, name in CountOfIngredient.objects.filter(
+        recipe__in=candidates.values('pk')
+    ).values_list('recipe_id', 'ingredients__name').iterator():
+        documents[pk].setdefault('ingredients', []).extend(
+            normalize_search(name).split()
+        )
+    ranks = {}
+    for pk, fields in documents.items():
+        rank = 0
+        for stem in stems:
+            matched = [
+                FALLBACK_WEIGHTS[field]
+                for field, words in fields.items()
+                if any(word.startswith(stem) for word in words)
+            ]
+            if not matched:
+                break
+            rank += sum(matched)
+        else:
+            ranks[pk] = rank
+    return ranks
+
+
+def search_recipes(queryset, value):
+    """Отбирает рецепты по запросу и добавляет аннотацию rank."""
+    if is_postgresql():
+        query = SearchQuery(value, config=SEARCH_CONFIG,
+                            search_type='websearch')
+        return queryset.filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query)
+        )
+    ranks = get_fallback_ranks(value)
+    if not ranks:
+        return queryset.none().annotate(
+            rank=Value(0, output_field=FloatField())
+        )
+    return queryset.filter(pk__in=ranks).annotate(rank=Case(
+        *(When(pk=pk, then=Value(rank)) for pk, rank in ranks.items()),
+        output_field=FloatField(),
+    ))
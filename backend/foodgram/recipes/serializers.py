@@ -1,12 +1,32 @@
-from django.shortcuts import get_object_or_404
-from drf_extra_fields.fields import Base64ImageField
+import json
+
+from django.conf import settings
+from django.core.files.images import get_image_dimensions
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from django.http import QueryDict
+from django.utils.functional import cached_property
 from rest_framework import serializers
+from rest_framework.exceptions import NotFound
 from rest_framework.fields import SerializerMethodField
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.validators import UniqueTogetherValidator
 
 from users.models import CustomUser
 
-from .models import CountOfIngredient, Ingredient, Recipe, RecipesFavorite, Tag
+from .cache import recipe_cache
+from .catalog import catalog
+from .fields import Base64ImageField
+from .images import build_image_variants, release_image
+from .models import (CountOfIngredient, Ingredient, Recipe, RecipesFavorite,
+                     Shoplist, Tag, get_recipe_prefetches)
+from .tasks import enqueue
+from .utils import change_recipe_in_shopping_totals
+
+INVALID_LIST_ERROR = 'Ожидается список'
+IMAGE_SIZE_ERROR = 'Картинка не должна быть больше {max_side}px по стороне'
+BATCH_EMPTY_ERROR = 'Укажите рецепты'
 
 
 class AuthorSerializer(serializers.ModelSerializer):
@@ -55,6 +75,35 @@ class TagSerializer(serializers.ModelSerializer):
         lookup_field = 'slug'
 
 
+class CatalogTagField(serializers.RelatedField):
+    def to_representation(self, value):
+        tag = catalog.get_tag(value.pk)
+        if tag is None:
+            return TagSerializer(value).data
+        return tag
+
+
+class ImageVariantsField(serializers.Field):
+    """Ссылки на уменьшенные копии картинки по размерам и форматам."""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        kwargs.setdefault('source', 'image_variants')
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        images = {}
+        for variant, formats in value.items():
+            images[variant] = {}
+            for extension, name in formats.items():
+                url = default_storage.url(name)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                images[variant][extension] = url
+        return images
+
+
 class FavoriteSerializer(serializers.ModelSerializer):
     id = serializers.CharField(
         read_only=True, source='recipe.id',
@@ -88,11 +137,24 @@ class FavoriteSerializer(serializers.ModelSerializer):
         fields = ('id', 'cooking_time', 'name', 'image')
 
 
+class RecipeListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        """Связанные объекты загружаются только для рецептов не из кеша."""
+        recipes = list(data.all() if hasattr(data, 'all') else data)
+        prefetch_related_objects([
+            recipe for recipe in recipes
+            if not recipe_cache.has(
+                recipe.pk, self.child.get_cache_version(recipe)
+            )
+        ], *get_recipe_prefetches())
+        return super().to_representation(recipes)
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     name = serializers.CharField(
         required=True,
     )
-    tags = TagSerializer(many=True, read_only=True)
+    tags = CatalogTagField(many=True, read_only=True)
     author = AuthorSerializer(read_only=True)
     ingredients = CountOfIngredientSerializer(
         many=True,
@@ -102,90 +164,230 @@ class RecipeSerializer(serializers.ModelSerializer):
     is_favorited = SerializerMethodField()
     is_in_shopping_cart = SerializerMethodField()
     image = Base64ImageField()
+    images = ImageVariantsField()
     text = serializers.CharField()
     cooking_time = serializers.IntegerField(max_value=32767, min_value=1)
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'name', 'image', 'text',
+                  'is_in_shopping_cart', 'name', 'image', 'images', 'text',
                   'cooking_time')
         read_only_fields = (
             'is_favorited',
             'is_in_shopping_cart',
         )
+        list_serializer_class = RecipeListSerializer
+
+    user_fields = ('is_favorited', 'is_in_shopping_cart')
+
+    @cached_property
+    def common_cache_version(self):
+        request = self.context.get('request')
+        return (
+            catalog.get_tags_checksum(),
+            catalog.get_ingredients_checksum(),
+            request.build_absolute_uri('/') if request else None,
+        )
+
+    def get_cache_version(self, instance):
+        return (instance.modified, self.common_cache_version)
+
+    def to_representation(self, instance):
+        """Рецепт из кеша, пользовательские поля вычисляются заново."""
+        version = self.get_cache_version(instance)
+        encoded = recipe_cache.get(instance.pk, version)
+        if encoded is None:
+            prefetch_related_objects([instance], *get_recipe_prefetches())
+            data = super().to_representation(instance)
+            user_data = {name: data.pop(name) for name in self.user_fields}
+            recipe_cache.set(instance.pk, version, json.dumps(
+                data, cls=JSONEncoder, ensure_ascii=False,
+                separators=(',', ':'),
+            ).encode())
+            data.update(user_data)
+            return data
+        data = json.loads(encoded)
+        for name in self.user_fields:
+            field = self.fields[name]
+            data[name] = field.to_representation(field.get_attribute(instance))
+        return data
 
     def get_is_favorited(self, obj):
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
-        return Recipe.objects.filter(recipes_favorite__user=user, id=obj.id).exists()
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
+        return RecipesFavorite.objects.filter(user=user, recipe=obj).exists()
 
     def get_is_in_shopping_cart(self, obj):
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
-        return Recipe.objects.filter(shopping_cart__user=user, id=obj.id).exists()
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
+        return Shoplist.objects.filter(user=user, recipe=obj).exists()
+
+    def validate_image(self, value):
+        max_side = settings.RECIPE_IMAGE_MAX_SIDE
+        if max(get_image_dimensions(value)) > max_side:
+            raise serializers.ValidationError(
+                IMAGE_SIZE_ERROR.format(max_side=max_side)
+            )
+        return value
+
+    def get_list_data(self, name):
+        """Список из тела запроса.
+
+        В multipart- и form-запросе список передаётся повторяющимся
+        полем или одним полем со строкой JSON.
+        """
+        if not isinstance(self.initial_data, QueryDict):
+            return self.initial_data.get(name)
+        values = self.initial_data.getlist(name)
+        if len(values) == 1 and values[0].lstrip().startswith('['):
+            try:
+                return json.loads(values[0])
+            except ValueError:
+                raise serializers.ValidationError({name: INVALID_LIST_ERROR})
+        return values
 
     def validate(self, data):
-        ingredients = self.initial_data.get('ingredients')
+        data['tags'] = self.get_list_data('tags')
+        ingredients = self.get_list_data('ingredients')
         if not ingredients:
             raise serializers.ValidationError({
                 'ingredients': 'Нужен хоть один ингридиент для рецепта'})
-        ingredient_list = []
+        amounts = {}
         for ingredient_item in ingredients:
-            ingredient = get_object_or_404(Ingredient,
-                                           id=ingredient_item['id'])
-            if ingredient in ingredient_list:
+            ingredient_id = int(ingredient_item['id'])
+            if ingredient_id in amounts:
                 raise serializers.ValidationError('Ингридиенты должны '
                                                   'быть уникальными')
-            ingredient_list.append(ingredient)
-            if int(ingredient_item['amount']) < 0:
+            amounts[ingredient_id] = int(ingredient_item['amount'])
+            if amounts[ingredient_id] < 0:
                 raise serializers.ValidationError({
                     'ingredients': ('Убедитесь, что значение количества '
                                     'ингредиента больше 0')
                 })
-        data['ingredients'] = ingredients
+        found = Ingredient.objects.filter(id__in=amounts).count()
+        if found != len(amounts):
+            raise NotFound('Ингредиент не найден')
+        data['ingredients'] = amounts
         return data
 
-    def create_ingredients(self, ingredients, recipe):
-        for ingredient in ingredients:
-            CountOfIngredient.objects.create(
+    def create_ingredients(self, amounts, recipe):
+        CountOfIngredient.objects.bulk_create(
+            CountOfIngredient(
                 recipe=recipe,
-                ingredients_id=ingredient.get('id'),
-                amount=ingredient.get('amount'),
+                ingredients_id=ingredient_id,
+                amount=amount,
             )
+            for ingredient_id, amount in amounts.items()
+        )
 
+    def update_ingredients(self, amounts, recipe):
+        current = {
+            item.ingredients_id: item
+            for item in CountOfIngredient.objects.filter(recipe=recipe)
+        }
+        old_amounts = {
+            ingredient_id: item.amount
+            for ingredient_id, item in current.items()
+        }
+        removed = current.keys() - amounts.keys()
+        if removed:
+            CountOfIngredient.objects.filter(
+                recipe=recipe, ingredients_id__in=removed
+            ).delete()
+        changed = []
+        for ingredient_id, item in current.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and item.amount != amount:
+                item.amount = amount
+                changed.append(item)
+        if changed:
+            CountOfIngredient.objects.bulk_update(changed, ['amount'])
+        self.create_ingredients({
+            ingredient_id: amount
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in current
+        }, recipe)
+        return old_amounts
+
+    @transaction.atomic
     def create(self, validated_data):
         image = validated_data.pop('image')
-        context = self.context['request']
         ingredients_data = validated_data.pop('ingredients')
+        tags_data = validated_data.pop('tags')
         recipe = Recipe.objects.create(image=image, **validated_data)
-        tags_data = self.initial_data.get('tags')
+        image.close()
         recipe.tags.set(tags_data)
         self.create_ingredients(ingredients_data, recipe)
-        return recipe
+        enqueue(build_image_variants, recipe.pk)
+        return Recipe.objects.with_related().get(pk=recipe.pk)
 
+    @transaction.atomic
     def update(self, instance, validated_data):
+        old_image = instance.image.name
         instance.image = validated_data.get('image', instance.image)
         instance.name = validated_data.get('name', instance.name)
         instance.text = validated_data.get('text', instance.text)
         instance.cooking_time = validated_data.get(
             'cooking_time', instance.cooking_time
         )
-        instance.tags.clear()
-        tags_data = self.initial_data.get('tags')
-        instance.tags.set(tags_data)
-        CountOfIngredient.objects.filter(recipe=instance).all().delete()
-        self.create_ingredients(validated_data.get('ingredients'), instance)
+        instance.tags.set(validated_data.get('tags'))
+        amounts = validated_data.get('ingredients')
+        old_amounts = self.update_ingredients(amounts, instance)
         instance.save()
-        return instance
+        change_recipe_in_shopping_totals(instance, old_amounts, amounts)
+        if 'image' in validated_data:
+            validated_data['image'].close()
+        if instance.image.name != old_image:
+            enqueue(build_image_variants, instance.pk)
+            enqueue(release_image, old_image)
+        return Recipe.objects.with_related().get(pk=instance.pk)
+
+
+class CookableRecipeSerializer(RecipeSerializer):
+    covered = serializers.IntegerField(read_only=True)
+    missing = serializers.IntegerField(read_only=True)
+
+    user_fields = RecipeSerializer.user_fields + ('covered', 'missing')
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ('covered', 'missing')
 
 
 class SimpleRecipeSerializer(serializers.ModelSerializer):
     image = Base64ImageField()
+    images = ImageVariantsField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'images', 'cooking_time')
         read_only_fields = ('id', 'name', 'image', 'cooking_time')
+
+
+class RecipeBatchSerializer(serializers.Serializer):
+    """Список рецептов для пакетного добавления или удаления.
+
+    Флаг all допускается только при удалении и означает весь список
+    пользователя.
+    """
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        max_length=settings.RECIPE_BATCH_MAX_SIZE,
+        required=False,
+    )
+    all = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        if data['all'] and self.context['request'].method == 'DELETE':
+            data['recipes'] = None
+        elif not data.get('recipes'):
+            raise serializers.ValidationError(BATCH_EMPTY_ERROR)
+        else:
+            data['recipes'] = list(dict.fromkeys(data['recipes']))
+        return data
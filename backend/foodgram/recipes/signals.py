@@ -0,0 +1,130 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from users.models import CustomUser
+
+from .cache import recipe_cache
+from .catalog import catalog
+from .images import release_image
+from .models import (CountOfIngredient, Ingredient, Recipe, Tag,
+                     normalize_search)
+from .search import update_search_vectors
+from .serializers import AuthorSerializer
+from .tasks import enqueue
+from .utils import (change_counter, change_recipe_in_shopping_totals,
+                    fan_out_recipe, get_recipe_amounts)
+
+AUTHOR_FIELDS = set(AuthorSerializer.Meta.fields)
+
+
+@receiver(connection_created)
+def register_sqlite_functions(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function(
+            'normalize_search', 1, normalize_search, deterministic=True
+        )
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_shopping_totals(sender, instance, **kwargs):
+    change_recipe_in_shopping_totals(
+        instance, get_recipe_amounts(instance), {}
+    )
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_catalog(sender, **kwargs):
+    catalog.invalidate()
+    recipe_cache.clear()
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipe_cache(sender, instance, **kwargs):
+    recipe_cache.invalidate(instance.pk)
+
+
+def touch_recipes(recipe_ids):
+    """Обновляет дату изменения рецептов и сбрасывает их кеш."""
+    Recipe.objects.filter(pk__in=recipe_ids).update(modified=timezone.now())
+    for recipe_id in recipe_ids:
+        recipe_cache.invalidate(recipe_id)
+
+
+@receiver(post_save, sender=CountOfIngredient)
+@receiver(post_delete, sender=CountOfIngredient)
+def touch_recipe_ingredients(sender, instance, **kwargs):
+    """Ингредиенты можно изменить, не сохраняя рецепт, например в админке."""
+    touch_recipes([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def touch_recipe_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        recipe_ids = [instance.pk]
+    elif action == 'pre_clear':
+        recipe_ids = list(instance.recipes.values_list('pk', flat=True))
+    else:
+        recipe_ids = list(pk_set)
+    touch_recipes(recipe_ids)
+
+
+@receiver(post_save, sender=CustomUser)
+def touch_author_recipes(sender, instance, created, update_fields, **kwargs):
+    """Данные автора входят в рецепт, поэтому меняют дату изменения."""
+    if created:
+        return
+    if update_fields is not None and not set(update_fields) & AUTHOR_FIELDS:
+        return
+    Recipe.objects.filter(author=instance).update(modified=timezone.now())
+
+
+@receiver(post_save, sender=Recipe)
+def increase_recipes_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(
+            CustomUser.objects.filter(pk=instance.author_id),
+            'recipes_count', 1
+        )
+
+
+@receiver(post_save, sender=Recipe)
+def add_recipe_to_timelines(sender, instance, created, **kwargs):
+    if created:
+        fan_out_recipe(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrease_recipes_count(sender, instance, **kwargs):
+    change_counter(
+        CustomUser.objects.filter(pk=instance.author_id), 'recipes_count', -1
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search_vector(sender, instance, **kwargs):
+    transaction.on_commit(lambda: update_search_vectors(
+        Recipe.objects.filter(pk=instance.pk)
+    ))
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_search_vectors(sender, instance, created, **kwargs):
+    if not created:
+        transaction.on_commit(lambda: update_search_vectors(
+            Recipe.objects.filter(ingredients=instance)
+        ))
+
+
+@receiver(post_delete, sender=Recipe)
+def release_recipe_image(sender, instance, **kwargs):
+    enqueue(release_image, instance.image.name)
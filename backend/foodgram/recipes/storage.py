@@ -0,0 +1,65 @@
+import hashlib
+import os
+import time
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Файлы под именами из SHA-256 содержимого.
+
+    Одинаковые файлы хранятся один раз: повторное сохранение
+    возвращает имя уже записанного файла и обновляет время его
+    изменения, по которому release() и collect_media_garbage
+    отличают недавно использованные файлы.
+    """
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        directory, basename = os.path.split(name)
+        hexdigest = digest.hexdigest()
+        name = os.path.join(
+            directory,
+            hexdigest[:2],
+            hexdigest + os.path.splitext(basename)[1].lower(),
+        )
+        if self.touch(name):
+            return name
+        return super()._save(name, content)
+
+    def touch(self, name):
+        try:
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def release(self, name, is_referenced, grace):
+        """Удаляет файл, если он больше никому не нужен.
+
+        Файл сначала атомарно переименовывается: сохранение того же
+        содержимого после этого запишет его заново. Если файл
+        использовался в последние grace секунд или is_referenced()
+        вернула True, он возвращается на место. Возвращает True,
+        если файл удалён.
+        """
+        path = self.path(name)
+        released = f'{path}.released'
+        try:
+            os.replace(path, released)
+        except FileNotFoundError:
+            return False
+        if (time.time() - os.path.getmtime(released) < grace
+                or is_referenced()):
+            os.replace(released, path)
+            return False
+        os.remove(released)
+        return True
+
+
+recipe_image_storage = ContentAddressedStorage()
@@ -0,0 +1,34 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.BACKGROUND_TASK_WORKERS,
+    thread_name_prefix='recipes-task',
+)
+
+
+def run_task(func, *args):
+    close_old_connections()
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('Фоновая задача %s завершилась ошибкой', func)
+    finally:
+        close_old_connections()
+
+
+def enqueue(func, *args):
+    """Выполняет func в пуле потоков процесса после коммита транзакции.
+
+    При BACKGROUND_TASKS_EAGER задача выполняется сразу в текущем
+    потоке, это нужно для тестов и отладки.
+    """
+    if settings.BACKGROUND_TASKS_EAGER:
+        transaction.on_commit(lambda: func(*args))
+    else:
+        transaction.on_commit(lambda: executor.submit(run_task, func, *args))
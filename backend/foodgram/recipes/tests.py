@@ -0,0 +1,994 @@
+import base64
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock
+from urllib.parse import urlencode
+
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from users.models import CustomUser
+
+from .benchmarks import BENCHMARKS
+from .cache import RecipeCache, recipe_cache
+from .catalog import catalog
+from .fields import Base64ImageField
+from .filters import IngredientSearchFilter, RecipeFilter
+from .images import build_image_variants, get_variant_files
+from .models import (CountOfIngredient, Ingredient, Recipe, RecipesFavorite,
+                     Shoplist, ShoplistIngredient, Tag)
+from .search import get_fallback_candidates, search_recipes
+from .storage import recipe_image_storage
+from .utils import can_insert_returning, update_shopping_totals
+
+PNG = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8Dw'
+    'HwAFBQIAX8jx0gAAAABJRU5ErkJggg=='
+)
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def create_user(username):
+    return CustomUser.objects.create_user(
+        username=username,
+        email=f'{username}@example.com',
+        first_name=username,
+        last_name=username,
+        password='password',
+    )
+
+
+def create_recipe(author, name, tags=(), ingredients=None, cooking_time=10):
+    recipe = Recipe.objects.create(
+        author=author,
+        name=name,
+        text=name,
+        cooking_time=cooking_time,
+        image=SimpleUploadedFile('image.png', PNG, 'image/png'),
+    )
+    recipe.tags.set(tags)
+    CountOfIngredient.objects.bulk_create(
+        CountOfIngredient(recipe=recipe, ingredients=ingredient, amount=amount)
+        for ingredient, amount in (ingredients or {}).items()
+    )
+    return recipe
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, BACKGROUND_TASKS_EAGER=True)
+class RecipesTestCase(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            catalog.invalidate()
+        recipe_cache.clear()
+
+    def get_client(self, user=None):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        return client
+
+    def count_queries(self, client, url):
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+
+class RecipeListQueriesTest(RecipesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        author = create_user('author')
+        tags = [
+            Tag.objects.create(name=f'Тег {i}', color='#fff', slug=f'tag{i}')
+            for i in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'ингредиент {i}',
+                                      measurement_unit='г')
+            for i in range(10)
+        ]
+        for i in range(50):
+            recipe = create_recipe(
+                author, f'Рецепт {i}', tags[:i % 3 + 1],
+                {ingredient: i + 1 for ingredient in ingredients[:i % 10]},
+            )
+            if i % 2:
+                RecipesFavorite.objects.create(user=cls.user, recipe=recipe)
+            if i % 3:
+                Shoplist.objects.create(user=cls.user, recipe=recipe)
+
+    def assert_constant_queries(self, client):
+        counts = []
+        for limit in (1, 50):
+            catalog.get_tags()
+            recipe_cache.clear()
+            counts.append(self.count_queries(
+                client, f'/api/recipes/?limit={limit}'
+            ))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_list_queries_do_not_depend_on_page_size(self):
+        self.assert_constant_queries(self.get_client(self.user))
+
+    def test_anonymous_list_queries_do_not_depend_on_page_size(self):
+        self.assert_constant_queries(self.get_client())
+
+    def test_list_queries(self):
+        catalog.get_tags()
+        client = self.get_client(self.user)
+        with self.assertNumQueries(7):
+            response = client.get('/api/recipes/?limit=50')
+        self.assertEqual(len(response.data['results']), 50)
+        with self.assertNumQueries(5):
+            client.get('/api/recipes/?limit=50')
+
+
+@override_settings(
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'catalog': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'catalog-tests',
+        },
+    },
+    CATALOG_CACHE='catalog',
+    CATALOG_VERSION_INTERVAL=60,
+)
+class CatalogTest(RecipesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+
+    def setUp(self):
+        caches['catalog'].clear()
+        super().setUp()
+
+    def test_shared_version_is_read_once_per_interval(self):
+        catalog.get_ingredients()
+        with mock.patch.object(
+            caches['catalog'], 'get', wraps=caches['catalog'].get
+        ) as cache_get:
+            for _ in range(12):
+                catalog.get_ingredients()
+                catalog.get_tags()
+        cache_get.assert_not_called()
+
+    def test_invalidation_waits_for_commit(self):
+        self.assertEqual(catalog.get_ingredients()[0]['name'], 'соль')
+        with self.captureOnCommitCallbacks() as callbacks:
+            Ingredient.objects.filter(pk=self.salt.pk).update(name='сахар')
+            catalog.invalidate()
+            self.assertEqual(catalog.get_ingredients()[0]['name'], 'соль')
+        for callback in callbacks:
+            callback()
+        self.assertEqual(catalog.get_ingredients()[0]['name'], 'сахар')
+
+
+class ConditionalGetTest(RecipesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+        cls.recipe = create_recipe(
+            create_user('author'), 'Суп', ingredients={cls.salt: 5}
+        )
+
+    def assert_edit_changes_etag(self, url, edit):
+        client = self.get_client()
+        etag = client.get(url)['ETag']
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            edit()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def rename_salt(self):
+        self.salt.name = 'морская соль'
+        self.salt.save()
+
+    def test_ingredient_rename_changes_list_etag(self):
+        data = self.assert_edit_changes_etag('/api/recipes/', self.rename_salt)
+        self.assertEqual(
+            data['results'][0]['ingredients'][0]['name'], 'морская соль'
+        )
+
+    def test_ingredient_rename_changes_detail_etag(self):
+        data = self.assert_edit_changes_etag(
+            f'/api/recipes/{self.recipe.pk}/', self.rename_salt
+        )
+        self.assertEqual(data['ingredients'][0]['name'], 'морская соль')
+
+    def test_amount_edit_changes_etag(self):
+        amount = CountOfIngredient.objects.get(recipe=self.recipe)
+
+        def edit():
+            amount.amount += 1
+            amount.save()
+
+        for url in ('/api/recipes/', f'/api/recipes/{self.recipe.pk}/'):
+            with self.subTest(url=url):
+                self.assert_edit_changes_etag(url, edit)
+
+    def test_tag_change_changes_etag(self):
+        tag = Tag.objects.create(name='Суп', color='#f00', slug='soup')
+        data = self.assert_edit_changes_etag(
+            f'/api/recipes/{self.recipe.pk}/',
+            lambda: self.recipe.tags.add(tag),
+        )
+        self.assertEqual(data['tags'][0]['slug'], 'soup')
+
+
+class LatestForAuthorsTest(RecipesTestCase):
+    def test_recipes_are_ordered_by_author_and_date(self):
+        authors = [create_user(f'author{i}') for i in range(3)]
+        for i in range(12):
+            create_recipe(authors[i * 7 % 3], f'Рецепт {i}')
+        author_ids = [author.pk for author in reversed(authors)]
+        for limit in (2, 10):
+            with self.subTest(limit=limit):
+                expected = []
+                for author in sorted(author_ids):
+                    expected += Recipe.objects.filter(
+                        author_id=author
+                    ).order_by('-pub_date', '-id')[:limit]
+                self.assertEqual(
+                    list(Recipe.objects.latest_for_authors(author_ids, limit)),
+                    expected,
+                )
+
+
+@override_settings(FEED_CELEBRITY_FOLLOWERS=2)
+class FeedTest(RecipesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.readers = [create_user(f'reader{i}') for i in range(3)]
+
+    def subscribe(self, reader, method='post'):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.get_client(reader), method)(
+                f'/api/users/{self.author.pk}/subscribe/'
+            )
+        self.assertLess(response.status_code, 300)
+
+    def publish(self, name):
+        self.author.refresh_from_db()
+        return create_recipe(self.author, name).pk
+
+    def get_feed(self, reader):
+        response = self.get_client(reader).get('/api/recipes/feed/')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_feed_survives_threshold_crossings(self):
+        first, second, third = self.readers
+        self.subscribe(first)
+        before = self.publish('До')
+        self.subscribe(second)
+        during = self.publish('Во время')
+        self.subscribe(third)
+        self.assertEqual(self.get_feed(first), [during, before])
+        self.assertEqual(self.get_feed(third), [during, before])
+        self.subscribe(second, 'delete')
+        self.subscribe(third, 'delete')
+        after = self.publish('После')
+        self.assertEqual(self.get_feed(first), [after, during, before])
+
+    def test_new_follower_of_celebrity_gets_backfill(self):
+        first, second, third = self.readers
+        self.subscribe(first)
+        self.subscribe(second)
+        recipe = self.publish('Рецепт')
+        self.subscribe(third)
+        self.subscribe(first, 'delete')
+        self.subscribe(second, 'delete')
+        self.assertEqual(self.get_feed(third), [recipe])
+
+
+class RecipeSearchTest(RecipesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('author')
+        beet = Ingredient.objects.create(name='Свёкла', measurement_unit='г')
+        cls.borscht = create_recipe(author, 'Борщ', ingredients={beet: 300})
+        cls.salad = create_recipe(author, 'Салат со свёклой')
+        cls.soup = create_recipe(author, 'Суп')
+        cls.soup.text = 'СВЕКОЛЬНЫЙ отвар'
+        cls.soup.save()
+        for i in range(5):
+            create_recipe(author, f'Каша {i}')
+
+    def search(self, query, **params):
+        response = self.get_client().get(
+            '/api/recipes/', {'search': query, **params}
+        )
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_search_ranks_name_above_ingredients_and_text(self):
+        self.assertEqual(
+            self.search('свекла'),
+            [self.salad.pk, self.borscht.pk, self.soup.pk],
+        )
+
+    def test_fallback_loads_only_candidates(self):
+        if connection.vendor == 'postgresql':
+            self.skipTest('Используется полнотекстовый поиск')
+        self.assertCountEqual(
+            get_fallback_candidates(['свек']).values_list('pk', flat=True),
+            [self.salad.pk, self.borscht.pk, self.soup.pk],
+        )
+        self.assertEqual(
+            search_recipes(Recipe.objects.all(), 'каша').count(), 5
+        )
+
+    def test_cursor_search_keeps_feed_order(self):
+        self.assertEqual(
+            self.search('свекла', cursor=''),
+            [self.soup.pk, self.salad.pk, self.borscht.pk],
+        )
+
+
+class CookableTest(RecipesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('author')
+        cls.salt, cls.milk, cls.egg, cls.flour = [
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('соль', 'молоко', 'яйцо', 'мука')
+        ]
+        cls.omelette = create_recipe(
+            author, 'Омлет', ingredients={cls.egg: 3, cls.milk: 50}
+        )
+        cls.pancakes = create_recipe(
+            author, 'Блины',
+            ingredients={cls.egg: 2, cls.milk: 500, cls.flour: 200},
+            cooking_time=40,
+        )
+        cls.bread = create_recipe(
+            author, 'Хлеб', ingredients={cls.flour: 500, cls.salt: 5}
+        )
+
+    def cookable(self, *ingredients, **params):
+        response = self.get_client().get('/api/recipes/cookable/', {
+            'ingredients': [ingredient.pk for ingredient in ingredients],
+            **params,
+        })
+        self.assertEqual(response.status_code, 200)
+        return [
+            (recipe['name'], recipe['covered'], recipe['missing'])
+            for recipe in response.data['results']
+        ]
+
+    def test_recipes_are_ranked_by_missing_ingredients(self):
+        self.assertEqual(self.cookable(self.egg, self.milk), [
+            ('Омлет', 2, 0), ('Блины', 2, 1),
+        ])
+        self.assertEqual(self.cookable(self.egg, self.milk, self.flour), [
+            ('Блины', 3, 0), ('Омлет', 2, 0), ('Хлеб', 1, 1),
+        ])
+
+    def test_filters(self):
+        self.assertEqual(
+            self.cookable(self.egg, self.flour, cooking_time=30),
+            [('Хлеб', 1, 1), ('Омлет', 1, 1)],
+        )
+        self.assertEqual(
+            self.cookable(self.egg, self.milk, max_missing=0),
+            [('Омлет', 2, 0)],
+        )
+
+    def test_ingredients_are_required(self):
+        response = self.get_client().get('/api/recipes/cookable/')
+        self.assertEqual(response.status_code, 400)
+
+
+class RecipeFilterTestCase(RecipesTestCase):
+    def get_ids(self, params, user=None):
+        response = self.get_client(user).get('/api/recipes/', params)
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def get_plan(self, params, user=None):
+        if connection.vendor != 'sqlite':
+            self.skipTest('План проверяется только для SQLite')
+        request = Request(APIRequestFactory().get('/', params))
+        request.user = user
+        recipes = RecipeFilter(
+            request.query_params, Recipe.objects.all(), request=request
+        )
+        self.assertTrue(recipes.is_valid(), recipes.errors)
+        return recipes.qs.explain()
+
+
+class TagFilterTest(RecipeFilterTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('author')
+        cls.soup, cls.salad = [
+            Tag.objects.create(name=name, color=color, slug=slug)
+            for name, color, slug in (
+                ('Суп', '#f00', 'soup'), ('Салат', '#0f0', 'salad')
+            )
+        ]
+        cls.both = create_recipe(author, 'Оба', (cls.soup, cls.salad))
+        cls.only_soup = create_recipe(author, 'Суп', (cls.soup,))
+        cls.untagged = create_recipe(author, 'Без тегов')
+
+    def test_any_mode_returns_each_recipe_once(self):
+        self.assertEqual(
+            self.get_ids({'tags': ['soup', 'salad']}),
+            [self.only_soup.pk, self.both.pk],
+        )
+
+    def test_all_mode_requires_every_tag(self):
+        self.assertEqual(
+            self.get_ids({'tags': ['soup', 'salad'], 'tags_mode': 'all'}),
+            [self.both.pk],
+        )
+        self.assertEqual(
+            self.get_ids({'tags': ['soup'], 'tags_mode': 'all'}),
+            [self.only_soup.pk, self.both.pk],
+        )
+
+    def test_repeated_slugs_are_counted_once(self):
+        for mode in ('any', 'all'):
+            with self.subTest(mode=mode):
+                params = {'tags': ['soup', 'soup'], 'tags_mode': mode}
+                self.assertEqual(
+                    self.get_ids(params), [self.only_soup.pk, self.both.pk]
+                )
+
+    def test_invalid_values_are_rejected(self):
+        for params in ({'tags': 'unknown'}, {'tags_mode': 'some'}):
+            with self.subTest(params=params):
+                response = self.get_client().get('/api/recipes/', params)
+                self.assertEqual(response.status_code, 400)
+
+    def test_tag_slugs_are_resolved_without_queries(self):
+        catalog.get_tags()
+        client = self.get_client()
+        plain = self.count_queries(client, '/api/recipes/?limit=1')
+        recipe_cache.clear()
+        self.assertEqual(
+            self.count_queries(client, '/api/recipes/?limit=1&tags=soup'),
+            plain,
+        )
+
+    def test_tag_filters_use_indexes(self):
+        plan = self.get_plan({'tags': ['soup', 'salad']})
+        self.assertIn('SEARCH U0 USING COVERING INDEX', plan)
+        self.assertNotIn('DISTINCT', plan)
+        plan = self.get_plan({'tags': ['soup', 'salad'], 'tags_mode': 'all'})
+        self.assertIn(
+            'USING COVERING INDEX recipe_tags_tag_recipe_idx (tag_id=?)', plan
+        )
+
+
+class RecipeFieldFilterTest(RecipeFilterTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.author = create_user('author')
+        cls.quick, cls.medium, cls.slow = [
+            create_recipe(cls.author, name, cooking_time=cooking_time)
+            for name, cooking_time in (
+                ('Быстро', 5), ('Средне', 30), ('Долго', 120)
+            )
+        ]
+        cls.own = create_recipe(cls.user, 'Своё', cooking_time=30)
+        RecipesFavorite.objects.create(user=cls.user, recipe=cls.quick)
+        Shoplist.objects.create(user=cls.user, recipe=cls.slow)
+
+    def test_boolean_filters(self):
+        everything = [self.own.pk, self.slow.pk, self.medium.pk, self.quick.pk]
+        for field, matched in (
+            ('is_favorited', self.quick.pk),
+            ('is_in_shopping_cart', self.slow.pk),
+        ):
+            for value in ('1', 'true'):
+                with self.subTest(field=field, value=value):
+                    self.assertEqual(
+                        self.get_ids({field: value}, self.user), [matched]
+                    )
+            for value in ('0', 'false'):
+                with self.subTest(field=field, value=value):
+                    self.assertEqual(
+                        self.get_ids({field: value}, self.user),
+                        [pk for pk in everything if pk != matched],
+                    )
+
+    def test_boolean_filters_for_anonymous(self):
+        for field in ('is_favorited', 'is_in_shopping_cart'):
+            with self.subTest(field=field):
+                self.assertEqual(self.get_ids({field: '1'}), [])
+                self.assertEqual(len(self.get_ids({field: '0'})), 4)
+
+    def test_invalid_values_are_rejected(self):
+        for params in (
+            {'is_favorited': 'yes'},
+            {'is_in_shopping_cart': '2'},
+            {'cooking_time__lte': 'fast'},
+            {'author': 'me'},
+        ):
+            with self.subTest(params=params):
+                response = self.get_client(self.user).get(
+                    '/api/recipes/', params
+                )
+                self.assertEqual(response.status_code, 400)
+
+    def test_author_and_cooking_time(self):
+        self.assertEqual(
+            self.get_ids({'author': self.user.pk}), [self.own.pk]
+        )
+        self.assertEqual(
+            self.get_ids({'cooking_time__gte': 30, 'cooking_time__lte': 60}),
+            [self.own.pk, self.medium.pk],
+        )
+        self.assertEqual(
+            self.get_ids({'author': self.author.pk, 'cooking_time__lte': 30}),
+            [self.medium.pk, self.quick.pk],
+        )
+
+    def test_field_filters_use_indexes(self):
+        for field, index in (
+            ('is_favorited', 'recipes_recipesfavorite'),
+            ('is_in_shopping_cart', 'recipes_shoplist'),
+        ):
+            with self.subTest(field=field):
+                plan = self.get_plan({field: '1'}, self.user)
+                self.assertRegex(
+                    plan, rf'SEARCH U0 USING COVERING INDEX \S*{index}'
+                )
+        self.assertIn(
+            'USING INDEX recipe_author_pub_date_idx (author_id=?)',
+            self.get_plan({'author': self.author.pk}),
+        )
+
+
+class RecipeImageTest(RecipesTestCase):
+    def test_metadata_is_stripped(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x8825] = {1: 'N', 2: (55.0, 45.0, 0.0)}
+        buffer = io.BytesIO()
+        Image.new('RGB', (4, 2), 'red').save(
+            buffer, 'JPEG', exif=exif.tobytes()
+        )
+        data = base64.b64encode(buffer.getvalue()).decode()
+        file = Base64ImageField().to_internal_value(
+            f'data:image/jpeg;base64,{data}'
+        )
+        with Image.open(file) as image:
+            self.assertEqual(image.format, 'JPEG')
+            self.assertEqual(image.size, (2, 4))
+            self.assertEqual(dict(image.getexif()), {})
+
+    def test_force_rebuilds_existing_variants(self):
+        recipe = create_recipe(create_user('author'), 'Суп')
+        build_image_variants(recipe.pk)
+        recipe.refresh_from_db()
+        name = recipe.image_variants['thumb']['jpeg']
+        default_storage.delete(name)
+        default_storage.save(name, SimpleUploadedFile('broken', b'broken'))
+        call_command('build_image_variants', stdout=StringIO())
+        with default_storage.open(name) as file:
+            self.assertEqual(file.read(), b'broken')
+        call_command('build_image_variants', '--all', stdout=StringIO())
+        with default_storage.open(name) as file, Image.open(file) as image:
+            self.assertEqual(image.format, 'JPEG')
+
+
+class RecipeUploadTest(RecipesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('author')
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {i}', color='#fff', slug=f'tag{i}')
+            for i in range(2)
+        ]
+        cls.salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+
+    def get_data(self, image):
+        return {
+            'name': 'Суп',
+            'text': 'Сварить',
+            'cooking_time': 10,
+            'tags': [tag.pk for tag in self.tags],
+            'ingredients': f'[{{"id": {self.salt.pk}, "amount": 5}}]',
+            'image': image,
+        }
+
+    def assert_created(self, response):
+        self.assertEqual(response.status_code, 201, response.data)
+        recipe = Recipe.objects.get(pk=response.data['id'])
+        self.assertCountEqual(recipe.tags.all(), self.tags)
+        self.assertEqual(recipe.recipe_ingredients.get().amount, 5)
+
+    def test_form_upload(self):
+        image = f'data:image/png;base64,{base64.b64encode(PNG).decode()}'
+        self.assert_created(self.get_client(self.user).post(
+            '/api/recipes/',
+            urlencode(self.get_data(image), doseq=True),
+            content_type='application/x-www-form-urlencoded',
+        ))
+
+    def test_multipart_upload(self):
+        image = SimpleUploadedFile('image.png', PNG, 'image/png')
+        self.assert_created(self.get_client(self.user).post(
+            '/api/recipes/', self.get_data(image), format='multipart'
+        ))
+
+
+class ReleaseImageTest(RecipesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.recipe = create_recipe(create_user('author'), 'Суп')
+        self.image = self.recipe.image.name
+        for name in get_variant_files(self.image):
+            default_storage.save(name, ContentFile(PNG))
+        past = time.time() - 3600
+        os.utime(recipe_image_storage.path(self.image), (past, past))
+
+    def delete_recipe(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.delete()
+
+    def test_unreferenced_image_is_deleted(self):
+        self.delete_recipe()
+        self.assertFalse(recipe_image_storage.exists(self.image))
+        for name in get_variant_files(self.image):
+            self.assertFalse(default_storage.exists(name))
+
+    def test_shared_image_is_kept(self):
+        create_recipe(create_user('other'), 'Суп')
+        self.delete_recipe()
+        self.assertTrue(recipe_image_storage.exists(self.image))
+
+    def test_recently_reused_image_is_kept(self):
+        self.assertEqual(
+            recipe_image_storage.save('recipes/copy.png', ContentFile(PNG)),
+            self.image,
+        )
+        self.delete_recipe()
+        self.assertTrue(recipe_image_storage.exists(self.image))
+        for name in get_variant_files(self.image):
+            self.assertTrue(default_storage.exists(name))
+
+    def test_image_saved_during_release_is_kept(self):
+        def save_again():
+            recipe_image_storage.save('recipes/copy.png', ContentFile(PNG))
+            return True
+
+        self.assertFalse(recipe_image_storage.release(
+            self.image, save_again, grace=60
+        ))
+        with recipe_image_storage.open(self.image) as file:
+            self.assertEqual(file.read(), PNG)
+        self.assertEqual(
+            os.listdir(os.path.dirname(recipe_image_storage.path(self.image))),
+            [os.path.basename(self.image)],
+        )
+
+
+class BatchAddTest(RecipesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        author = create_user('author')
+        cls.recipes = [create_recipe(author, f'Рецепт {i}') for i in range(3)]
+        RecipesFavorite.objects.create(user=cls.user, recipe=cls.recipes[0])
+
+    def add(self):
+        ids = [recipe.pk for recipe in self.recipes] + [999999]
+        with CaptureQueriesContext(connection) as context:
+            response = self.get_client(self.user).post(
+                '/api/recipes/favorite/', {'recipes': ids}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            [400, 201, 201, 404],
+        )
+        self.assertEqual(
+            list(Recipe.objects.filter(pk__in=ids).order_by('pk').values_list(
+                'favorites_count', flat=True
+            )),
+            [0, 1, 1],
+        )
+        return [
+            query['sql'] for query in context.captured_queries
+            if query['sql'].startswith('INSERT')
+        ]
+
+    def test_batch_is_inserted_at_once(self):
+        if not can_insert_returning():
+            self.skipTest('База не поддерживает INSERT ... RETURNING')
+        inserts = self.add()
+        self.assertEqual(len(inserts), 1)
+        self.assertIn('ON CONFLICT DO NOTHING RETURNING', inserts[0])
+
+    def test_fallback_inserts_rows_one_by_one(self):
+        with mock.patch('recipes.views.can_insert_returning',
+                        return_value=False):
+            self.assertEqual(len(self.add()), 2)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, BACKGROUND_TASKS_EAGER=True)
+class ConcurrentAddTest(TransactionTestCase):
+    threads = 8
+
+    def setUp(self):
+        if connection.vendor == 'sqlite':
+            self.skipTest('SQLite не даёт параллельно писать в транзакциях')
+
+    def test_parallel_adds_count_once(self):
+        user = create_user('reader')
+        recipe = create_recipe(create_user('author'), 'Суп')
+        barrier = threading.Barrier(self.threads)
+        statuses = []
+
+        def add():
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                barrier.wait()
+                statuses.append(client.post(
+                    f'/api/recipes/{recipe.pk}/favorite/'
+                ).status_code)
+            finally:
+                connections.close_all()
+
+        threads = [
+            threading.Thread(target=add) for _ in range(self.threads)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(statuses), [201] + [400] * (self.threads - 1))
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assertEqual(RecipesFavorite.objects.filter(
+            user=user, recipe=recipe
+        ).count(), 1)
+
+
+class RecipeCacheTest(RecipesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.author = create_user('author')
+        cls.tag = Tag.objects.create(name='Суп', color='#f00', slug='soup')
+        cls.recipe = create_recipe(cls.author, 'Борщ', (cls.tag,))
+        RecipesFavorite.objects.create(user=cls.user, recipe=cls.recipe)
+
+    def get_recipe(self, user=None):
+        response = self.get_client(user).get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        return response.data['results'][0]
+
+    @override_settings(RECIPE_CACHE_MAX_SIZE=10)
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = RecipeCache()
+        cache.set(1, 'v', b'1234')
+        cache.set(2, 'v', b'1234')
+        self.assertEqual(cache.get(1, 'v'), b'1234')
+        cache.set(3, 'v', b'1234')
+        self.assertIsNone(cache.get(2, 'v'))
+        self.assertEqual(cache.get(1, 'v'), b'1234')
+        self.assertIsNone(cache.get(3, 'other'))
+        cache.set(4, 'v', b'12345678901')
+        self.assertIsNone(cache.get(4, 'v'))
+        self.assertEqual(cache.stats()['size'], 8)
+
+    def test_user_fields_are_not_cached(self):
+        self.assertTrue(self.get_recipe(self.user)['is_favorited'])
+        self.assertFalse(self.get_recipe(self.author)['is_favorited'])
+        self.assertFalse(self.get_recipe()['is_favorited'])
+        self.assertEqual(recipe_cache.stats()['recipes'], 1)
+
+    def test_changes_invalidate_cached_recipes(self):
+        self.get_recipe()
+        self.recipe.name = 'Щи'
+        self.recipe.save()
+        self.assertEqual(self.get_recipe()['name'], 'Щи')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.name = 'Супы'
+            self.tag.save()
+        self.assertEqual(self.get_recipe()['tags'][0]['name'], 'Супы')
+        self.author.first_name = 'Автор'
+        self.author.save()
+        self.assertEqual(self.get_recipe()['author']['first_name'], 'Автор')
+
+    def test_direct_ingredient_and_tag_edits_invalidate_cache(self):
+        salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+        amount = CountOfIngredient.objects.create(
+            recipe=self.recipe, ingredients=salt, amount=5
+        )
+        self.assertEqual(self.get_recipe()['ingredients'][0]['amount'], 5)
+        amount.amount = 7
+        amount.save()
+        self.assertEqual(self.get_recipe()['ingredients'][0]['amount'], 7)
+        amount.delete()
+        self.assertEqual(self.get_recipe()['ingredients'], [])
+        self.recipe.tags.clear()
+        self.assertEqual(self.get_recipe()['tags'], [])
+        self.tag.recipes.add(self.recipe)
+        self.assertEqual(len(self.get_recipe()['tags']), 1)
+
+
+class ShoppingListTest(RecipesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('buyer')
+        cls.salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+        cls.milk = Ingredient.objects.create(
+            name='молоко', measurement_unit='мл'
+        )
+        cls.recipes = [
+            create_recipe(cls.user, f'Рецепт {i}',
+                          ingredients={cls.salt: 5, cls.milk: 100 * (i + 1)})
+            for i in range(20)
+        ]
+
+    def download(self, client):
+        response = client.get(
+            '/api/recipes/download_shopping_cart/', HTTP_ACCEPT='text/plain'
+        )
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_download_sums_ingredients_in_one_query(self):
+        client = self.get_client(self.user)
+        client.post(f'/api/recipes/{self.recipes[0].pk}/shopping_cart/')
+        with self.assertNumQueries(1):
+            self.download(client)
+        client.post(
+            '/api/recipes/shopping_cart/',
+            {'recipes': [recipe.pk for recipe in self.recipes]},
+            format='json',
+        )
+        with self.assertNumQueries(1):
+            content = self.download(client)
+        self.assertEqual(
+            content, 'молоко (мл) - 21000\nсоль (г) - 100\n'
+        )
+
+
+class BenchmarkCommandTest(RecipesTestCase):
+    def test_benchmarks_run_and_roll_back(self):
+        for name in BENCHMARKS:
+            with self.subTest(name=name):
+                stdout = StringIO()
+                call_command('benchmark', name, size=20, repeat=1,
+                             stdout=stdout)
+                self.assertIn(name, stdout.getvalue())
+                self.assertFalse(Recipe.objects.filter(
+                    name__startswith='benchmark'
+                ).exists())
+                self.assertFalse(CustomUser.objects.filter(
+                    username__startswith='benchmark'
+                ).exists())
+
+
+class ShoppingTotalsTest(RecipesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('buyer')
+        cls.salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+        cls.milk = Ingredient.objects.create(
+            name='молоко', measurement_unit='мл'
+        )
+        cls.soup = create_recipe(cls.user, 'Суп',
+                                 ingredients={cls.salt: 5, cls.milk: 100})
+        cls.bread = create_recipe(cls.user, 'Хлеб',
+                                  ingredients={cls.salt: 10})
+
+    def get_totals(self):
+        return dict(ShoplistIngredient.objects.filter(
+            user=self.user
+        ).values_list('ingredient__name', 'amount'))
+
+    def test_totals_follow_cart(self):
+        client = self.get_client(self.user)
+        client.post(f'/api/recipes/{self.soup.pk}/shopping_cart/')
+        client.post(f'/api/recipes/{self.bread.pk}/shopping_cart/')
+        self.assertEqual(self.get_totals(), {'соль': 15, 'молоко': 100})
+        client.delete(f'/api/recipes/{self.soup.pk}/shopping_cart/')
+        self.assertEqual(self.get_totals(), {'соль': 10})
+        client.delete(f'/api/recipes/{self.bread.pk}/shopping_cart/')
+        self.assertEqual(self.get_totals(), {})
+
+    def test_fallback_retries_concurrent_insert(self):
+        raced = []
+
+        def insert_before_savepoint(execute, sql, params, many, context):
+            if sql.startswith('SAVEPOINT') and not raced:
+                raced.append(sql)
+                execute(
+                    f'INSERT INTO {ShoplistIngredient._meta.db_table} '
+                    '(user_id, ingredient_id, amount) VALUES (%s, %s, 7)',
+                    [self.user.pk, self.salt.pk], False, context,
+                )
+            return execute(sql, params, many, context)
+
+        with mock.patch.object(connection, 'vendor', 'mysql'), \
+                connection.execute_wrapper(insert_before_savepoint):
+            update_shopping_totals(
+                [self.user.pk], {self.salt.pk: 5, self.milk.pk: 100}
+            )
+        self.assertTrue(raced)
+        self.assertEqual(self.get_totals(), {'соль': 12, 'молоко': 100})
+
+
+class IngredientAutocompleteTest(RecipesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('Фасоль', 'Соль морская', 'Соль', 'Сахар', 'Свёкла'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+        for i in range(30):
+            Ingredient.objects.create(name=f'Мука {i}', measurement_unit='г')
+
+    def search(self, query):
+        response = self.get_client().get(
+            '/api/ingredients/', {'name': query}
+        )
+        self.assertEqual(response.status_code, 200)
+        return [ingredient['name'] for ingredient in response.data]
+
+    def test_short_query_matches_prefix_only(self):
+        self.assertEqual(self.search('СО'), ['Соль', 'Соль морская'])
+
+    def test_prefix_matches_go_first(self):
+        self.assertEqual(
+            self.search('соль'), ['Соль', 'Соль морская', 'Фасоль']
+        )
+
+    def test_yo_is_normalized(self):
+        self.assertEqual(self.search('свек'), ['Свёкла'])
+        self.assertEqual(self.search('свёк'), ['Свёкла'])
+
+    def test_results_are_capped(self):
+        self.assertEqual(len(self.search('му')), 20)
+        response = self.get_client().get(
+            '/api/ingredients/', {'name': 'му', 'limit': 5}
+        )
+        self.assertEqual(len(response.data), 5)
+
+    def test_prefix_query_uses_index_range(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('План проверяется только для SQLite')
+        view = mock.Mock(action='list')
+        request = Request(APIRequestFactory().get('/', {'name': 'со'}))
+        queryset = IngredientSearchFilter().filter_queryset(
+            request, Ingredient.objects.all(), view
+        )
+        self.assertIn(
+            'USING INDEX ingredient_search_name_idx '
+            '(search_name>? AND search_name<?)',
+            queryset.explain(),
+        )
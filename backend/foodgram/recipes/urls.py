@@ -1,7 +1,8 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import IngredientsViewSet, RecipeViewSet, TagsViewSet
+from .views import (CatalogStatsView, IngredientsViewSet, RecipeViewSet,
+                    TagsViewSet)
 
 router = DefaultRouter()
 router.register('recipes', RecipeViewSet, basename='recipes')
@@ -10,5 +11,6 @@ router.register('tags', TagsViewSet, basename='tags')
 
 
 urlpatterns = (
+    path('catalog/stats/', CatalogStatsView.as_view(), name='catalog_stats'),
     path('', include(router.urls)),
 )
@@ -1,32 +1,534 @@
-from django.http import HttpResponse
+import csv
+import heapq
+import json
+import os
+import tempfile
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import (Case, Count, F, FloatField, Max, OuterRef, Q,
+                              Subquery, Sum, Value, When)
+from django.db.models.functions import Coalesce
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
 from rest_framework.serializers import ValidationError
 
-from .models import Shoplist
-
-
-def get_shopping_list(request):
-    shopping_cart = Shoplist.objects.filter(user=request.user).all()
-    shopping_list = {}
-    for item in shopping_cart:
-        for recipe_ingredient in item.recipe.recipe_ingredients.all():
-            name = recipe_ingredient.ingredients.name
-            measuring_unit = recipe_ingredient.ingredients.measurement_unit
-            amount = recipe_ingredient.amount
-            if name not in shopping_list:
-                shopping_list[name] = {
-                    'name': name,
-                    'measurement_unit': measuring_unit,
-                    'amount': amount
-                }
-            else:
-                shopping_list[name]['amount'] += amount
-    content = (
-        [f'{item["name"]} ({item["measurement_unit"]}) '
-         f'- {item["amount"]}\n'
-         for item in shopping_list.values()]
-    )
-    filename = 'shopping_list.txt'
-    response = HttpResponse(content, content_type='text/plain')
+from users.models import CustomUser, Subscribe
+
+from .models import (CountOfIngredient, Recipe, RecipesFavorite, Shoplist,
+                     ShoplistIngredient, TimelineEntry)
+from .tasks import enqueue
+
+SHOPPING_LIST_FONT = 'ShoppingList'
+STREAM_CHUNK_SIZE = 64 * 1024
+TRENDING_BATCH_SIZE = 500
+TRENDING_MIN_SCORE = 1e-3
+UPSERT_VENDORS = ('postgresql', 'sqlite')
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def change_counter(queryset, field, delta):
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def count_related(model, field):
+    return Coalesce(Subquery(
+        model.objects
+        .filter(**{field: OuterRef('pk')})
+        .order_by()
+        .values(field)
+        .annotate(count=Count('pk'))
+        .values('count')
+    ), 0)
+
+
+def recount_recipe_counters(queryset=None):
+    if queryset is None:
+        queryset = Recipe.objects.all()
+    return queryset.update(
+        favorites_count=count_related(RecipesFavorite, 'recipe'),
+        shopping_cart_count=count_related(Shoplist, 'recipe'),
+    )
+
+
+def recount_user_counters(queryset=None):
+    if queryset is None:
+        queryset = CustomUser.objects.all()
+    return queryset.update(
+        followers_count=count_related(Subscribe, 'author'),
+        recipes_count=count_related(Recipe, 'author'),
+    )
+
+
+def get_decay(seconds):
+    return 0.5 ** (max(seconds, 0) / settings.TRENDING_HALF_LIFE)
+
+
+def get_trending_events(since, now):
+    weights = settings.TRENDING_WEIGHTS
+    for model, weight in (
+        (RecipesFavorite, weights['favorite']),
+        (Shoplist, weights['shopping_cart']),
+    ):
+        events = model.objects.filter(created__lte=now)
+        if since is not None:
+            events = events.filter(created__gt=since)
+        for recipe_id, created in events.values_list(
+            'recipe_id', 'created'
+        ).iterator():
+            seconds = (now - created).total_seconds()
+            yield recipe_id, weight * get_decay(seconds)
+
+
+def update_trending_scores(full=False):
+    """Пересчитывает рейтинг популярности рецептов.
+
+    Рейтинг — сумма весов добавлений в избранное и в списки покупок,
+    каждое из которых затухает вдвое за TRENDING_HALF_LIFE секунд.
+    Без full накопленные значения умножаются на общий множитель
+    затухания и к ним прибавляются только события с прошлого запуска;
+    удалённые события при этом не вычитаются, их учитывает только
+    полный пересчёт.
+    """
+    now = timezone.now()
+    since = None
+    if not full:
+        since = Recipe.objects.aggregate(
+            since=Max('trending_updated')
+        )['since']
+    decay = since and get_decay((now - since).total_seconds())
+    if not decay:
+        since = None
+        Recipe.objects.exclude(trending_score=0).update(trending_score=0)
+    else:
+        Recipe.objects.filter(
+            trending_score__gte=TRENDING_MIN_SCORE / decay
+        ).update(
+            trending_score=F('trending_score') * decay,
+            trending_updated=now,
+        )
+        Recipe.objects.filter(
+            trending_score__gt=0, trending_score__lt=TRENDING_MIN_SCORE / decay
+        ).update(trending_score=0, trending_updated=now)
+    scores = defaultdict(float)
+    for recipe_id, score in get_trending_events(since, now):
+        scores[recipe_id] += score
+    scores = list(scores.items())
+    for start in range(0, len(scores), TRENDING_BATCH_SIZE):
+        batch = dict(scores[start:start + TRENDING_BATCH_SIZE])
+        Recipe.objects.filter(pk__in=batch).update(
+            trending_score=F('trending_score') + Case(
+                *(When(pk=recipe_id, then=Value(score))
+                  for recipe_id, score in batch.items()),
+                default=Value(0.0),
+                output_field=FloatField(),
+            ),
+            trending_updated=now,
+        )
+    return len(scores)
+
+
+def is_celebrity(author):
+    return author.followers_count >= settings.FEED_CELEBRITY_FOLLOWERS
+
+
+def fan_out_recipe(recipe):
+    if is_celebrity(recipe.author):
+        return
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(
+                user_id=user_id,
+                recipe=recipe,
+                author_id=recipe.author_id,
+                pub_date=recipe.pub_date,
+            )
+            for user_id in Subscribe.objects.filter(
+                author_id=recipe.author_id
+            ).values_list('user_id', flat=True).iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+def get_backfill_recipes(author_id):
+    return list(
+        Recipe.objects
+        .filter(author_id=author_id)
+        .order_by('-pub_date', '-id')
+        .values_list('id', 'pub_date')[:settings.FEED_BACKFILL_LIMIT]
+    )
+
+
+def backfill_timeline(user_id, author_id, recipes):
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(
+                user_id=user_id,
+                recipe_id=recipe_id,
+                author_id=author_id,
+                pub_date=pub_date,
+            )
+            for recipe_id, pub_date in recipes
+        ),
+        ignore_conflicts=True,
+    )
+
+
+def add_to_timeline(user, author):
+    """Переносит в ленту подписчика последние рецепты автора.
+
+    Рецепты популярных авторов тоже переносятся: если подписчиков
+    станет меньше порога, лента уже будет заполнена.
+    """
+    backfill_timeline(user.pk, author.pk, get_backfill_recipes(author.pk))
+
+
+def backfill_timelines(author_id):
+    """Заполняет ленты подписчиков автора, переставшего быть популярным.
+
+    Пока подписчиков было не меньше FEED_CELEBRITY_FOLLOWERS, новые
+    рецепты автора не раскладывались по лентам.
+    """
+    recipes = get_backfill_recipes(author_id)
+    for user_id in Subscribe.objects.filter(
+        author_id=author_id
+    ).values_list('user_id', flat=True).iterator():
+        backfill_timeline(user_id, author_id, recipes)
+
+
+def change_followers_count(author, delta):
+    change_counter(
+        CustomUser.objects.filter(pk=author.pk), 'followers_count', delta
+    )
+    count = CustomUser.objects.values_list(
+        'followers_count', flat=True
+    ).get(pk=author.pk)
+    threshold = settings.FEED_CELEBRITY_FOLLOWERS
+    if count < threshold <= count - delta:
+        enqueue(backfill_timelines, author.pk)
+
+
+def remove_from_timeline(user, author):
+    TimelineEntry.objects.filter(user=user, author=author).delete()
+
+
+def get_keyset_after(values, date_field, id_field):
+    if values is None:
+        return Q()
+    pub_date, pk = values
+    return (
+        Q(**{f'{date_field}__lt': pub_date})
+        | Q(**{date_field: pub_date, f'{id_field}__lt': pk})
+    )
+
+
+def get_feed_ids(user, limit, after=None):
+    """Идентификаторы рецептов ленты подписок после курсора after.
+
+    Рецепты авторов, у которых меньше FEED_CELEBRITY_FOLLOWERS
+    подписчиков, раскладываются по лентам при публикации. Рецепты
+    популярных авторов выбираются при чтении и сливаются с лентой.
+    """
+    timeline = (
+        TimelineEntry.objects
+        .filter(get_keyset_after(after, 'pub_date', 'recipe'), user=user)
+        .order_by('-pub_date', '-recipe')
+        .values_list('pub_date', 'recipe_id')[:limit]
+    )
+    sources = [timeline]
+    celebrities = list(
+        Subscribe.objects.filter(
+            user=user,
+            author__followers_count__gte=settings.FEED_CELEBRITY_FOLLOWERS,
+        ).values_list('author_id', flat=True)
+    )
+    if celebrities:
+        sources.append(
+            Recipe.objects
+            .filter(
+                get_keyset_after(after, 'pub_date', 'id'),
+                author_id__in=celebrities,
+            )
+            .order_by('-pub_date', '-id')
+            .values_list('pub_date', 'id')[:limit]
+        )
+    ids = []
+    for pub_date, recipe_id in heapq.merge(*sources, reverse=True):
+        if recipe_id in ids:
+            continue
+        ids.append(recipe_id)
+        if len(ids) == limit:
+            break
+    return ids
+
+
+def get_recipe_amounts(recipe):
+    return dict(
+        CountOfIngredient.objects
+        .filter(recipe=recipe)
+        .values_list('ingredients_id', 'amount')
+    )
+
+
+def get_recipes_amounts(recipe_ids):
+    return dict(
+        CountOfIngredient.objects
+        .filter(recipe_id__in=recipe_ids)
+        .values_list('ingredients_id')
+        .annotate(amount=Sum('amount'))
+        .order_by()
+    )
+
+
+def can_insert_returning():
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 35)
+    return connection.vendor == 'postgresql'
+
+
+def insert_user_recipes(model, user_id, recipe_ids):
+    """Добавляет рецепты в список одной командой INSERT ... ON CONFLICT.
+
+    Уже добавленные рецепты пропускает сама база, RETURNING отдаёт
+    только вставленные строки, в том числе при параллельных вставках.
+    """
+    table = connection.ops.quote_name(model._meta.db_table)
+    created = model._meta.get_field('created').get_db_prep_save(
+        timezone.now(), connection
+    )
+    fields = ('user_id', 'recipe_id', 'created')
+    rows = [(user_id, recipe_id, created) for recipe_id in recipe_ids]
+    batch_size = connection.ops.bulk_batch_size(fields, rows)
+    added = []
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            cursor.execute(
+                f'INSERT INTO {table} ({", ".join(fields)}) '
+                f'VALUES {", ".join(["(%s, %s, %s)"] * len(batch))} '
+                f'ON CONFLICT DO NOTHING RETURNING recipe_id',
+                [value for row in batch for value in row],
+            )
+            added.extend(recipe_id for recipe_id, in cursor.fetchall())
+    return added
+
+
+def upsert_shopping_totals(rows):
+    """Прибавляет количества одной командой INSERT ... ON CONFLICT.
+
+    Строка либо вставляется, либо обновляется внутри одной команды,
+    поэтому параллельные добавления не конфликтуют по уникальности.
+    """
+    table = connection.ops.quote_name(ShoplistIngredient._meta.db_table)
+    fields = ('user_id', 'ingredient_id', 'amount')
+    batch_size = connection.ops.bulk_batch_size(fields, rows)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            cursor.execute(
+                f'INSERT INTO {table} ({", ".join(fields)}) '
+                f'VALUES {", ".join(["(%s, %s, %s)"] * len(batch))} '
+                f'ON CONFLICT (user_id, ingredient_id) DO UPDATE '
+                f'SET amount = {table}.amount + EXCLUDED.amount',
+                [value for row in batch for value in row],
+            )
+
+
+def merge_shopping_totals(user_ids, amounts):
+    """Прибавляет количества на базах без INSERT ... ON CONFLICT.
+
+    Если недостающую строку успел вставить параллельный запрос,
+    вставка откатывается до точки сохранения и повторяется
+    построчно, а существующие строки обновляются через F().
+    """
+    totals = ShoplistIngredient.objects.filter(
+        user_id__in=user_ids, ingredient_id__in=amounts
+    )
+    existing = set(totals.values_list('user_id', 'ingredient_id'))
+    if existing:
+        totals.update(amount=F('amount') + Case(
+            *(When(ingredient_id=ingredient_id, then=Value(amount))
+              for ingredient_id, amount in amounts.items()),
+            default=Value(0),
+        ))
+    missing = [
+        ShoplistIngredient(
+            user_id=user_id, ingredient_id=ingredient_id, amount=amount
+        )
+        for user_id in user_ids
+        for ingredient_id, amount in amounts.items()
+        if (user_id, ingredient_id) not in existing
+    ]
+    try:
+        with transaction.atomic():
+            ShoplistIngredient.objects.bulk_create(missing)
+    except IntegrityError:
+        for total in missing:
+            try:
+                with transaction.atomic():
+                    total.save(force_insert=True)
+            except IntegrityError:
+                ShoplistIngredient.objects.filter(
+                    user_id=total.user_id, ingredient_id=total.ingredient_id
+                ).update(amount=F('amount') + total.amount)
+
+
+def update_shopping_totals(user_ids, amounts):
+    amounts = {
+        ingredient_id: amount
+        for ingredient_id, amount in amounts.items() if amount
+    }
+    user_ids = list(user_ids)
+    if not user_ids or not amounts:
+        return
+    if connection.vendor in UPSERT_VENDORS:
+        upsert_shopping_totals([
+            (user_id, ingredient_id, amount)
+            for user_id in user_ids
+            for ingredient_id, amount in amounts.items()
+        ])
+    else:
+        merge_shopping_totals(user_ids, amounts)
+    if any(amount < 0 for amount in amounts.values()):
+        ShoplistIngredient.objects.filter(
+            user_id__in=user_ids, ingredient_id__in=amounts, amount__lte=0
+        ).delete()
+
+
+def add_to_shopping_totals(user, recipe_ids):
+    update_shopping_totals([user.id], get_recipes_amounts(recipe_ids))
+
+
+def remove_from_shopping_totals(user, recipe_ids):
+    amounts = get_recipes_amounts(recipe_ids)
+    update_shopping_totals(
+        [user.id],
+        {ingredient_id: -amount for ingredient_id, amount in amounts.items()}
+    )
+
+
+def change_recipe_in_shopping_totals(recipe, old_amounts, new_amounts):
+    amounts = {
+        ingredient_id: (
+            new_amounts.get(ingredient_id, 0)
+            - old_amounts.get(ingredient_id, 0)
+        )
+        for ingredient_id in {*old_amounts, *new_amounts}
+    }
+    if not any(amounts.values()):
+        return
+    user_ids = Shoplist.objects.filter(recipe=recipe).values_list(
+        'user_id', flat=True
+    )
+    update_shopping_totals(user_ids, amounts)
+
+
+def get_expected_shopping_totals():
+    return (
+        CountOfIngredient.objects
+        .filter(recipe__shopping_cart__isnull=False)
+        .values_list('recipe__shopping_cart__user', 'ingredients')
+        .annotate(amount=Sum('amount'))
+        .order_by()
+        .iterator()
+    )
+
+
+def get_shopping_items(user):
+    return (
+        ShoplistIngredient.objects
+        .filter(user=user, amount__gt=0)
+        .values_list(
+            'ingredient__name', 'ingredient__measurement_unit', 'amount'
+        )
+        .order_by('ingredient__name', 'ingredient__measurement_unit')
+        .iterator()
+    )
+
+
+def shopping_list_txt(items):
+    for name, measurement_unit, amount in items:
+        yield f'{name} ({measurement_unit}) - {amount}\n'
+
+
+def shopping_list_csv(items):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'measurement_unit', 'amount'))
+    for item in items:
+        yield writer.writerow(item)
+
+
+def shopping_list_json(items):
+    separator = '['
+    for name, measurement_unit, amount in items:
+        yield separator + json.dumps({
+            'name': name,
+            'measurement_unit': measurement_unit,
+            'amount': amount,
+        }, ensure_ascii=False)
+        separator = ',\n'
+    yield ']' if separator == ',\n' else '[]'
+
+
+def register_shopping_list_font():
+    if SHOPPING_LIST_FONT in pdfmetrics.getRegisteredFontNames():
+        return
+    font_path = settings.SHOPPING_LIST_FONT
+    if not os.path.exists(font_path):
+        font_path = os.path.join(settings.BASE_DIR, 'FUTURAM.ttf')
+    pdfmetrics.registerFont(TTFont(SHOPPING_LIST_FONT, font_path))
+
+
+def shopping_list_pdf(items):
+    register_shopping_list_font()
+    buffer = tempfile.SpooledTemporaryFile(max_size=STREAM_CHUNK_SIZE)
+    page = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    top, bottom, margin, line_height = height - 60, 40, 40, 18
+    page.setFont(SHOPPING_LIST_FONT, 16)
+    page.drawString(margin, top, 'Список покупок')
+    y = top - 2 * line_height
+    page.setFont(SHOPPING_LIST_FONT, 12)
+    for name, measurement_unit, amount in items:
+        if y < bottom:
+            page.showPage()
+            page.setFont(SHOPPING_LIST_FONT, 12)
+            y = top
+        page.drawString(margin, y, f'{name} ({measurement_unit}) - {amount}')
+        y -= line_height
+    page.save()
+    buffer.seek(0)
+    try:
+        yield from iter(lambda: buffer.read(STREAM_CHUNK_SIZE), b'')
+    finally:
+        buffer.close()
+
+
+SHOPPING_LIST_FORMATS = {
+    'txt': (shopping_list_txt, 'text/plain; charset=utf-8'),
+    'csv': (shopping_list_csv, 'text/csv; charset=utf-8'),
+    'json': (shopping_list_json, 'application/json'),
+    'pdf': (shopping_list_pdf, 'application/pdf'),
+}
+
+
+def get_shopping_list(request, file_format='txt'):
+    render, content_type = SHOPPING_LIST_FORMATS[file_format]
+    content = render(get_shopping_items(request.user))
+    filename = f'shopping_list.{file_format}'
+    response = StreamingHttpResponse(content, content_type=content_type)
     response['Content-Disposition'] = (
         'attachment; filename={0}'.format(filename)
     )
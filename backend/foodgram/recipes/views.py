@@ -1,34 +1,112 @@
-from django.shortcuts import get_object_or_404
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max
+from django.http import Http404
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import filters, status, viewsets
+from rest_framework import status, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import (IsAuthenticated,
+from rest_framework.permissions import (IsAdminUser, IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from .filters import TagsFilter
+from users.mixins import KeysetPaginationMixin
+from users.pagination import (FeedPagination, KeysetPagination,
+                              LimitPageNumberPagination)
+
+from .cache import recipe_cache
+from .catalog import catalog
+from .decorators import conditional_get
+from .filters import (IngredientSearchFilter, RecipeFilter,
+                      RecipeOrderingFilter, RecipeSearchFilter)
 from .models import Ingredient, Recipe, RecipesFavorite, Shoplist, Tag
+from .parsers import RECIPE_PARSERS
 from .permissions import AuthorOrReadOnly
-from .serializers import (IngredientSerializer, RecipeSerializer,
+from .renderers import SHOPPING_LIST_RENDERERS
+from .serializers import (CookableRecipeSerializer, IngredientSerializer,
+                          RecipeBatchSerializer, RecipeSerializer,
                           SimpleRecipeSerializer, TagSerializer)
-from .utils import get_shopping_list
+from .utils import (add_to_shopping_totals, can_insert_returning,
+                    change_counter, get_feed_ids, get_shopping_list,
+                    insert_user_recipes, remove_from_shopping_totals)
+
+COOKABLE_ERROR = 'Укажите хотя бы один ингредиент'
+COOKABLE_ORDERING = ('missing', '-covered', '-pub_date', '-id')
+ADDED_ERROR = 'Рецепт уже добавлен в список'
+DELETED_ERROR = 'Рецепт уже удален'
+NOT_FOUND_ERROR = 'Рецепт не найден'
+SIMPLE_RECIPE_FIELDS = (
+    'id', 'name', 'image', 'image_variants', 'cooking_time'
+)
+
+COUNTER_FIELDS = {
+    RecipesFavorite: 'favorites_count',
+    Shoplist: 'shopping_cart_count',
+}
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(KeysetPaginationMixin, viewsets.ModelViewSet):
     serializer_class = RecipeSerializer
-    filter_backends = (DjangoFilterBackend,)
-    filterset_class = TagsFilter
+    filter_backends = (
+        DjangoFilterBackend, RecipeOrderingFilter, RecipeSearchFilter
+    )
+    filterset_class = RecipeFilter
     permission_classes = [AuthorOrReadOnly]
+    pagination_class = LimitPageNumberPagination
+    parser_classes = RECIPE_PARSERS
+
+    @property
+    def keyset_ordering(self):
+        return RecipeOrderingFilter.get_ordering(self.request)
+
+    def get_conditional_state(self, request, *args, **kwargs):
+        user = request.user
+        if 'pk' in kwargs:
+            fields = ['modified']
+            if user.is_authenticated:
+                fields += ['is_favorited', 'is_in_shopping_cart']
+            state = None
+            if kwargs['pk'].isdecimal():
+                state = (
+                    Recipe.objects
+                    .filter(pk=kwargs['pk'])
+                    .with_user_flags(user)
+                    .values_list(*fields)
+                    .first()
+                )
+            last_modified = state[0] if state else None
+        elif (isinstance(self.paginator, KeysetPagination)
+              or RecipeOrderingFilter.is_requested(request)):
+            return None, None
+        else:
+            recipes = self.filter_queryset(self.get_queryset()).aggregate(
+                count=Count('id'), modified=Max('modified')
+            )
+            state = [recipes]
+            if user.is_authenticated:
+                state += [
+                    model.objects.filter(user=user).aggregate(
+                        count=Count('id'), last=Max('id')
+                    )
+                    for model in (RecipesFavorite, Shoplist)
+                ]
+            last_modified = recipes['modified']
+        checksums = (
+            catalog.get_tags_checksum(), catalog.get_ingredients_checksum()
+        )
+        return (checksums, state), last_modified
+
+    @conditional_get
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
     def get_queryset(self):
-        queryset = Recipe.objects.all()
-        is_favorited = self.request.query_params.get('is_favorited')
-        is_in_shopping_cart = self.request.query_params.get('is_in_shopping_cart')
-        if is_favorited:
-            queryset = queryset.filter(recipes_favorite__user=self.request.user)
-        if is_in_shopping_cart:
-            queryset = queryset.filter(shopping_cart__user=self.request.user)
-        return queryset
+        return Recipe.objects.with_author().with_user_flags(
+            self.request.user
+        )
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
@@ -54,37 +132,216 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return self.delete_obj(Shoplist, request.user, pk)
         return None
 
+    @action(
+        detail=False,
+        methods=['POST', 'DELETE'],
+        url_path='favorite',
+        url_name='favorite-batch',
+        permission_classes=[IsAuthenticated]
+    )
+    def favorite_batch(self, request):
+        return self.batch_obj(RecipesFavorite, request)
+
+    @action(
+        detail=False,
+        methods=['POST', 'DELETE'],
+        url_path='shopping_cart',
+        url_name='shopping-cart-batch',
+        permission_classes=[IsAuthenticated]
+    )
+    def shopping_cart_batch(self, request):
+        return self.batch_obj(Shoplist, request)
+
     @action(methods=('GET',), detail=False)
+    def cookable(self, request):
+        params = request.query_params
+        ingredients = [
+            int(pk) for pk in params.getlist('ingredients') if pk.isdecimal()
+        ]
+        if not ingredients:
+            return Response({
+                'errors': COOKABLE_ERROR
+            }, status=status.HTTP_400_BAD_REQUEST)
+        queryset = Recipe.objects.with_author().with_user_flags(
+            request.user
+        ).cookable_with(ingredients)
+        cooking_time = params.get('cooking_time', '')
+        if cooking_time.isdecimal():
+            queryset = queryset.filter(cooking_time__lte=cooking_time)
+        max_missing = params.get('max_missing', '')
+        if max_missing.isdecimal():
+            queryset = queryset.filter(missing__lte=max_missing)
+        page = self.paginate_queryset(queryset.order_by(*COOKABLE_ORDERING))
+        serializer = CookableRecipeSerializer(
+            page, many=True, context=self.get_serializer_context()
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=('GET',), detail=False,
+            permission_classes=[IsAuthenticated])
+    def feed(self, request):
+        paginator = FeedPagination()
+        queryset = Recipe.objects.with_author().with_user_flags(request.user)
+        page = paginator.paginate_queryset(queryset, request, self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    def get_page_ids(self, values, limit):
+        return get_feed_ids(self.request.user, limit, values)
+
+    @action(methods=('GET',), detail=False,
+            permission_classes=[IsAuthenticated],
+            renderer_classes=SHOPPING_LIST_RENDERERS)
     def download_shopping_cart(self, request):
-        return get_shopping_list(request)
+        return get_shopping_list(request, request.accepted_renderer.format)
+
+    def insert_objs(self, model, user, recipe_ids):
+        """Вставляет строки списка и возвращает действительно добавленные.
+
+        Повторное добавление, в том числе параллельное, отсекает
+        ограничение уникальности. Где есть INSERT ... ON CONFLICT
+        с RETURNING, все строки вставляются одной командой, иначе
+        каждая в своей точке сохранения.
+        """
+        if can_insert_returning():
+            return insert_user_recipes(model, user.pk, recipe_ids)
+        added = []
+        for pk in recipe_ids:
+            try:
+                with transaction.atomic():
+                    model.objects.create(user=user, recipe_id=pk)
+            except IntegrityError:
+                continue
+            added.append(pk)
+        return added
+
+    @transaction.atomic
+    def add_objs(self, model, user, ids):
+        """Добавляет рецепты в список пользователя.
+
+        Возвращает найденные рецепты по идентификаторам и множество
+        добавленных.
+        """
+        recipes = Recipe.objects.only(*SIMPLE_RECIPE_FIELDS).in_bulk(ids)
+        candidates = list(recipes)
+        if len(candidates) > 1:
+            existing = set(
+                model.objects.filter(user=user, recipe_id__in=candidates)
+                .values_list('recipe_id', flat=True)
+            )
+            candidates = [pk for pk in candidates if pk not in existing]
+        added = self.insert_objs(model, user, candidates)
+        if added:
+            change_counter(
+                Recipe.objects.filter(pk__in=added), COUNTER_FIELDS[model], 1
+            )
+            if model is Shoplist:
+                add_to_shopping_totals(user, added)
+        return recipes, set(added)
+
+    @transaction.atomic
+    def delete_objs(self, model, user, ids=None):
+        """Удаляет рецепты из списка пользователя, без ids — все.
+
+        Один рецепт удаляется одним запросом по числу удалённых строк,
+        несколько — после блокировки своих строк, поэтому параллельное
+        удаление не уменьшает счётчики дважды. Возвращает идентификаторы
+        удалённых рецептов.
+        """
+        objs = model.objects.filter(user=user)
+        if ids is not None:
+            objs = objs.filter(recipe_id__in=ids)
+        if ids is not None and len(ids) == 1:
+            deleted, _ = objs.delete()
+            deleted = ids if deleted else []
+        else:
+            deleted = list(
+                objs.select_for_update().values_list('recipe_id', flat=True)
+            )
+            if deleted:
+                model.objects.filter(user=user, recipe_id__in=deleted).delete()
+        if deleted:
+            change_counter(
+                Recipe.objects.filter(pk__in=deleted),
+                COUNTER_FIELDS[model],
+                -1,
+            )
+            if model is Shoplist:
+                remove_from_shopping_totals(user, deleted)
+        return deleted
 
     def add_obj(self, model, user, pk):
-        if model.objects.filter(user=user, recipe__id=pk).exists():
+        recipes, added = self.add_objs(model, user, [pk])
+        recipe = recipes.get(int(pk))
+        if recipe is None:
+            raise Http404
+        if recipe.pk not in added:
             return Response({
-                'errors': 'Рецепт уже добавлен в список'
+                'errors': ADDED_ERROR
             }, status=status.HTTP_400_BAD_REQUEST)
-        recipe = get_object_or_404(Recipe, id=pk)
-        model.objects.create(user=user, recipe=recipe)
         serializer = SimpleRecipeSerializer(recipe)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def delete_obj(self, model, user, pk):
-        obj = model.objects.filter(user=user, recipe__id=pk)
-        if obj.exists():
-            obj.delete()
+        if self.delete_objs(model, user, [pk]):
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response({
-            'errors': 'Рецепт уже удален'
+            'errors': DELETED_ERROR
         }, status=status.HTTP_400_BAD_REQUEST)
 
+    def batch_obj(self, model, request):
+        serializer = RecipeBatchSerializer(
+            data=request.data, context={'request': request}
+        )
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['recipes']
+        if request.method == 'DELETE':
+            deleted = self.delete_objs(model, request.user, ids)
+            if ids is None:
+                ids = deleted
+            deleted = set(deleted)
+            results = [
+                {'id': pk, 'status': status.HTTP_204_NO_CONTENT}
+                if pk in deleted else
+                {'id': pk, 'status': status.HTTP_400_BAD_REQUEST,
+                 'errors': DELETED_ERROR}
+                for pk in ids
+            ]
+            return Response({'results': results})
+        recipes, added = self.add_objs(model, request.user, ids)
+        results = []
+        for pk in ids:
+            if pk not in recipes:
+                results.append({'id': pk, 'status': status.HTTP_404_NOT_FOUND,
+                                'errors': NOT_FOUND_ERROR})
+            elif pk not in added:
+                results.append({'id': pk,
+                                'status': status.HTTP_400_BAD_REQUEST,
+                                'errors': ADDED_ERROR})
+            else:
+                results.append({'id': pk, 'status': status.HTTP_201_CREATED})
+        return Response({'results': results})
+
 
 class IngredientsViewSet(viewsets.ModelViewSet):
     pagination_class = None
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
-    filter_backends = (filters.SearchFilter,)
-    search_fields = ('^name',)
+    filter_backends = (IngredientSearchFilter,)
+
+    def get_conditional_state(self, request, *args, **kwargs):
+        return catalog.get_ingredients_checksum(), None
+
+    @conditional_get
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @conditional_get
+    def list(self, request, *args, **kwargs):
+        if IngredientSearchFilter.search_param in request.query_params:
+            return super().list(request, *args, **kwargs)
+        return Response(catalog.get_ingredients())
 
 
 class TagsViewSet(viewsets.ModelViewSet):
@@ -92,3 +349,25 @@ class TagsViewSet(viewsets.ModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+
+    def get_conditional_state(self, request, *args, **kwargs):
+        return catalog.get_tags_checksum(), None
+
+    @conditional_get
+    def list(self, request, *args, **kwargs):
+        return Response(catalog.get_tags())
+
+    @conditional_get
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs['pk']
+        tag = catalog.get_tag(int(pk)) if pk.isdecimal() else None
+        if tag is None:
+            return super().retrieve(request, *args, **kwargs)
+        return Response(tag)
+
+
+class CatalogStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({**catalog.stats(), 'recipes': recipe_cache.stats()})
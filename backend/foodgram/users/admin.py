@@ -7,7 +7,8 @@ from .models import CustomUser
 
 
 class UsersAdmin(admin.ModelAdmin):
-    list_display = ('username', 'first_name', 'last_name', 'email')
+    list_display = ('username', 'first_name', 'last_name', 'email',
+                    'recipes_count', 'followers_count')
     list_filter = ('username', 'email')
     search_fields = ('username', 'email')
     empty_value_display = "-пусто-"
@@ -28,9 +29,10 @@ class RecipesAdmin(admin.ModelAdmin):
     readonly_fields = ['count_recipes_favorite']
 
     def count_recipes_favorite(self, obj):
-        return obj.recipes_favorite.count()
+        return obj.favorites_count
 
     count_recipes_favorite.short_description = 'Популярность'
+    count_recipes_favorite.admin_order_field = 'favorites_count'
 
 
 class TagsAdmin(admin.ModelAdmin):
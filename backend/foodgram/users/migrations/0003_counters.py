@@ -0,0 +1,23 @@
+# Generated by Django 3.2 on 2026-10-18 19:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_subscribe_user_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Подписчики'),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Рецепты'),
+        ),
+    ]
@@ -2,6 +2,7 @@ from rest_framework import serializers
 from rest_framework.serializers import Serializer
 
 from .models import Subscribe
+from .pagination import KeysetPagination
 
 
 class IsSubscribedMixin(Serializer):
@@ -14,3 +15,14 @@ class IsSubscribedMixin(Serializer):
         return Subscribe.objects.filter(
             author=data, user=self.context.get('request').user
         ).exists()
+
+
+class KeysetPaginationMixin:
+    keyset_pagination_class = KeysetPagination
+
+    @property
+    def paginator(self):
+        if (not hasattr(self, '_paginator')
+                and self.keyset_pagination_class.is_requested(self.request)):
+            self._paginator = self.keyset_pagination_class()
+        return super().paginator
@@ -46,6 +46,14 @@ class CustomUser(AbstractUser):
         unique=True,
         verbose_name='Пароль',
     )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Подписчики',
+    )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Рецепты',
+    )
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
@@ -87,3 +95,8 @@ class Subscribe(models.Model):
                 name='unique follow'
             ),
         )
+        indexes = (
+            models.Index(
+                fields=('user', '-id'), name='subscribe_user_id_idx'
+            ),
+        )
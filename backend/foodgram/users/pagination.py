@@ -1,6 +1,140 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+INVALID_CURSOR_ERROR = 'Неверный курсор'
 
 
 class LimitPageNumberPagination(PageNumberPagination):
     page_size = 6
-    page_size_query_param = 'limit'
\ No newline at end of file
+    page_size_query_param = 'limit'
+
+
+class KeysetPagination(BasePagination):
+    """Постраничный вывод по ключу без OFFSET и COUNT(*).
+
+    Курсор хранит значения полей сортировки последней записи страницы,
+    следующая страница выбирается условием по этим полям, поэтому
+    сортировка должна быть уникальной и покрываться индексом.
+    """
+    cursor_query_param = 'cursor'
+    page_size = 6
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    ordering = ('-pub_date', '-id')
+
+    @classmethod
+    def is_requested(cls, request):
+        return cls.cursor_query_param in request.query_params
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_ordering(self, view):
+        return getattr(view, 'keyset_ordering', self.ordering)
+
+    def encode_cursor(self, instance):
+        values = []
+        for field in self.ordering:
+            value = getattr(instance, field.lstrip('-'))
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            values.append(value)
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, request, model):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(values) != len(self.ordering):
+                raise ValueError
+            return [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (TypeError, ValueError, binascii.Error, ValidationError):
+            raise NotFound(INVALID_CURSOR_ERROR)
+
+    def get_keyset_filter(self, values):
+        condition, equal = Q(), Q()
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(view)
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        values = self.decode_cursor(request, queryset.model)
+        if values is not None:
+            queryset = queryset.filter(self.get_keyset_filter(values))
+        results = list(queryset[:page_size + 1])
+        self.has_next = len(results) > page_size
+        self.page = results[:page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.page[-1]),
+        )
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+class FeedPagination(KeysetPagination):
+    """Курсорный вывод по идентификаторам, которые отдаёт представление.
+
+    Представление получает значения курсора и размер выборки в
+    get_page_ids(), записи страницы выбираются одним запросом.
+    """
+    ordering = ('-pub_date', '-id')
+
+    def get_ordering(self, view):
+        return self.ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        values = self.decode_cursor(request, queryset.model)
+        ids = view.get_page_ids(values, page_size + 1)
+        objects = queryset.in_bulk(ids)
+        results = [objects[pk] for pk in ids if pk in objects]
+        self.has_next = len(results) > page_size
+        self.page = results[:page_size]
+        return self.page
@@ -48,17 +48,19 @@ class SubscribeSerializer(serializers.ModelSerializer):
                   'is_subscribed', 'recipes', 'recipes_count')
 
     def get_is_subscribed(self, obj):
-        return Subscribe.objects.filter(
-            user=obj.user, author=obj.author
-        ).exists()
+        return True
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        queryset = Recipe.objects.filter(author=obj.author)
-        if limit:
-            queryset = queryset[:int(limit)]
-        return SimpleRecipeSerializer(queryset, many=True).data
+        recipes = self.context.get('recipes')
+        if recipes is not None:
+            recipes = recipes.get(obj.author_id, [])
+        else:
+            request = self.context.get('request')
+            limit = request.GET.get('recipes_limit')
+            recipes = Recipe.objects.filter(author=obj.author)
+            if limit:
+                recipes = recipes[:int(limit)]
+        return SimpleRecipeSerializer(recipes, many=True).data
 
     def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj.author).count()
+        return obj.author.recipes_count
@@ -1,38 +1,47 @@
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
 from djoser.views import UserViewSet
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.generics import get_object_or_404
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
+from recipes.models import Recipe
+from recipes.utils import (add_to_timeline, change_followers_count,
+                           remove_from_timeline)
+
+from .mixins import KeysetPaginationMixin
 from .models import CustomUser, Subscribe
+from .pagination import LimitPageNumberPagination
 from .serializers import SubscribeSerializer
 
 User = CustomUser()
 
 
-class CustomUserViewSet(UserViewSet):
-    pagination_class = PageNumberPagination
+class CustomUserViewSet(KeysetPaginationMixin, UserViewSet):
+    pagination_class = LimitPageNumberPagination
+    keyset_ordering = ('-id',)
 
     @action(detail=True, methods=['POST', 'DELETE'], permission_classes=[IsAuthenticated])
     def subscribe(self, request, id=None):
         user = request.user
         author = get_object_or_404(CustomUser, id=id)
         if request.method == 'POST':
-            user = request.user
-            author = get_object_or_404(CustomUser, id=id)
-
             if user == author:
                 return Response({
                     'errors': 'Вы не можете подписываться на самого себя'
                 }, status=status.HTTP_400_BAD_REQUEST)
-            if Subscribe.objects.filter(user=user, author=author).exists():
+            try:
+                with transaction.atomic():
+                    follow = Subscribe.objects.create(user=user, author=author)
+                    change_followers_count(author, 1)
+                    add_to_timeline(user, author)
+            except IntegrityError:
                 return Response({
                     'errors': 'Вы уже подписаны на данного пользователя'
                 }, status=status.HTTP_400_BAD_REQUEST)
-
-            follow = Subscribe.objects.create(user=user, author=author)
             serializer = SubscribeSerializer(
                 follow, context={'request': request}
             )
@@ -42,9 +51,14 @@ class CustomUserViewSet(UserViewSet):
                 return Response({
                     'errors': 'Вы не можете отписываться от самого себя'
                 }, status=status.HTTP_400_BAD_REQUEST)
-            follow = Subscribe.objects.filter(user=user, author=author)
-            if follow.exists():
-                follow.delete()
+            with transaction.atomic():
+                deleted, _ = Subscribe.objects.filter(
+                    user=user, author=author
+                ).delete()
+                if deleted:
+                    change_followers_count(author, -1)
+                    remove_from_timeline(user, author)
+            if deleted:
                 return Response(status=status.HTTP_204_NO_CONTENT)
 
             return Response({
@@ -55,11 +69,20 @@ class CustomUserViewSet(UserViewSet):
             permission_classes=[IsAuthenticated])
     def subscriptions(self, request):
         user = request.user
-        queryset = Subscribe.objects.filter(user=user)
+        queryset = Subscribe.objects.filter(user=user).select_related(
+            'author'
+        )
         pages = self.paginate_queryset(queryset)
+        limit = request.query_params.get('recipes_limit', '')
+        recipes = defaultdict(list)
+        for recipe in Recipe.objects.latest_for_authors(
+            [follow.author_id for follow in pages],
+            int(limit) if limit.isdecimal() else None,
+        ):
+            recipes[recipe.author_id].append(recipe)
         serializer = SubscribeSerializer(
             pages,
             many=True,
-            context={'request': request}
+            context={'request': request, 'recipes': recipes}
         )
         return self.get_paginated_response(serializer.data)